@@ -0,0 +1,131 @@
+"""Admission control for the webhook.
+
+Before ``/callback`` does any work it checks how loaded this worker is: the
+requests it is serving, the reply events still running from earlier
+batches, and how long the request waited in the router/gunicorn queue
+(from the ``X-Request-Start`` header Heroku and nginx add). Depending on
+the thresholds below the request is
+
+* admitted normally,
+* admitted **degraded**: bodies without a slash command are acked before the
+  SDK parses them, and commands are answered only from cached replies, or
+* **shed** with a fast 503, instead of a 200 that arrives after LINE has
+  given up and redelivered.
+
+The level decided for a request is kept in a context variable, which
+``ConcurrentWebhookHandler`` copies to its pool threads, so ``degraded()``
+inside a handler reflects the request that handler is serving.
+
+In-flight requests only exceed one per process with threaded workers
+(``gunicorn --threads N``). Under gunicorn's default sync worker the
+in-flight thresholds are reached through the backlog of reply events only,
+and the queue wait is the main signal.
+
+Counts of each outcome are reported at ``GET /metrics``.
+"""
+import contextvars
+import json
+import os
+import threading
+import time
+
+ADMIT_DEGRADE_INFLIGHT = int(os.getenv('CIQ_ADMIT_DEGRADE_INFLIGHT', '8'))
+ADMIT_SHED_INFLIGHT = int(os.getenv('CIQ_ADMIT_SHED_INFLIGHT', '16'))
+ADMIT_DEGRADE_WAIT_MS = float(os.getenv('CIQ_ADMIT_DEGRADE_WAIT_MS', '500'))
+ADMIT_SHED_WAIT_MS = float(os.getenv('CIQ_ADMIT_SHED_WAIT_MS', '2000'))
+
+NORMAL = 'normal'
+DEGRADED = 'degraded'
+SHED = 'shed'
+
+_request_level = contextvars.ContextVar('admission_level', default=NORMAL)
+
+
+def queue_wait_ms(request_start, now=None):
+    """Milliseconds since ``X-Request-Start`` (``t=`` prefix, s or ms epoch)."""
+    if not request_start:
+        return 0.0
+    try:
+        started = float(request_start.strip().removeprefix('t='))
+    except ValueError:
+        return 0.0
+    if started > 1e11:
+        started /= 1000  # milliseconds, as Heroku sends it
+    now = time.time() if now is None else now
+    return max(0.0, (now - started) * 1000)
+
+
+def has_command(body):
+    """Return True if a webhook body holds a text message starting with '/'."""
+    try:
+        events = json.loads(body).get('events', [])
+    except (ValueError, AttributeError):
+        return True  # let the SDK report malformed bodies
+    for event in events:
+        message = event.get('message') or {}
+        if message.get('type') == 'text' and message.get('text', '').lstrip().startswith('/'):
+            return True
+    return False
+
+
+class AdmissionController:
+    """Tracks in-flight work and decides whether to admit, degrade or shed."""
+
+    def __init__(self, backlog=None,
+                 degrade_inflight=ADMIT_DEGRADE_INFLIGHT, shed_inflight=ADMIT_SHED_INFLIGHT,
+                 degrade_wait_ms=ADMIT_DEGRADE_WAIT_MS, shed_wait_ms=ADMIT_SHED_WAIT_MS):
+        self.backlog = backlog or (lambda: 0)
+        self.degrade_inflight = degrade_inflight
+        self.shed_inflight = shed_inflight
+        self.degrade_wait_ms = degrade_wait_ms
+        self.shed_wait_ms = shed_wait_ms
+        self.inflight = 0
+        self.last_wait_ms = 0.0
+        self._lock = threading.Lock()
+        self._counts = {
+            NORMAL: 0,
+            DEGRADED: 0,
+            SHED: 0,
+            'skipped_early': 0,
+            'dropped_uncached': 0,
+        }
+
+    def _level(self, load, wait_ms):
+        if load >= self.shed_inflight or wait_ms >= self.shed_wait_ms:
+            return SHED
+        if load >= self.degrade_inflight or wait_ms >= self.degrade_wait_ms:
+            return DEGRADED
+        return NORMAL
+
+    def admit(self, request_start=None):
+        """Decide on a new request; call ``release()`` after any non-shed level."""
+        wait_ms = queue_wait_ms(request_start)
+        with self._lock:
+            self.last_wait_ms = wait_ms
+            level = self._level(self.inflight + self.backlog(), wait_ms)
+            self._counts[level] += 1
+            if level != SHED:
+                self.inflight += 1
+        _request_level.set(level)
+        return level
+
+    def release(self):
+        with self._lock:
+            self.inflight -= 1
+        _request_level.set(NORMAL)
+
+    def degraded(self):
+        """Return True if the request being served was admitted degraded."""
+        return _request_level.get() != NORMAL
+
+    def count(self, name):
+        with self._lock:
+            self._counts[name] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counts)
+            stats['inflight'] = self.inflight
+        stats['backlog'] = self.backlog()
+        stats['last_wait_ms'] = round(self.last_wait_ms, 1)
+        return stats
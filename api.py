@@ -0,0 +1,142 @@
+"""Read-only JSON API over the station data.
+
+    GET /api/stations              station codes and names
+    GET /api/stations/<code>       one station record
+    GET /api/stations.ndjson       every record, one JSON object per line
+
+Bodies are serialized and gzip-compressed once per dataset version (when the
+table is swapped, on the swapping thread), so serving a request is a dict
+lookup plus a copy. Every response carries a strong ETag and honours
+``If-None-Match`` with 304, so pollers only download data that changed.
+At most ``CIQ_API_MAX_CONCURRENT`` API requests run at once per worker
+process; the rest get a fast 503 instead of taking threads away from the
+webhook. The cap only matters with threaded workers (``gunicorn --threads``);
+a sync worker serves one request at a time anyway.
+"""
+import gzip
+import hashlib
+import json
+import os
+import threading
+
+from flask import Blueprint, Response, request
+
+from ciq_store import current, on_swap
+
+API_MAX_CONCURRENT = int(os.getenv('CIQ_API_MAX_CONCURRENT', '2'))
+STREAM_CHUNK = 64 * 1024
+
+api = Blueprint('api', __name__, url_prefix='/api')
+
+_slots = threading.BoundedSemaphore(API_MAX_CONCURRENT)
+_lock = threading.Lock()
+_serialized = None
+
+
+class _Body:
+    """One pre-serialized response body and its gzip variant."""
+
+    __slots__ = ('raw', 'gzipped', 'etag')
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.gzipped = gzip.compress(raw, compresslevel=9, mtime=0)
+        self.etag = hashlib.sha256(raw).hexdigest()[:32]
+
+
+class _Serialized:
+    """Every API body for one dataset version."""
+
+    def __init__(self, table):
+        self.version = table.version
+        records = {code: table[code].to_dict() for code in table}
+        self.index = _Body(_dumps({
+            'version': table.version,
+            'stations': [{'code': code, 'airport_name': info['airport_name']} for code, info in records.items()],
+        }))
+        self.stations = {
+            code: _Body(_dumps({'code': code, 'version': table.version, **info}))
+            for code, info in records.items()
+        }
+        self.ndjson = _Body(b''.join(_dumps({'code': code, **info}) + b'\n' for code, info in records.items()))
+
+
+def _dumps(value):
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def _build(table):
+    global _serialized
+    bodies = _Serialized(table)
+    with _lock:
+        if table is current():
+            _serialized = bodies
+    return bodies
+
+
+def serialized():
+    """Return the bodies for the served table, building them if it changed."""
+    table = current()
+    bodies = _serialized
+    if bodies is None or bodies.version != table.version:
+        bodies = _build(table)
+    return bodies
+
+
+def _respond(body, mimetype, stream=False):
+    use_gzip = request.accept_encodings.quality('gzip') > 0
+    etag = f"{body.etag}-gz" if use_gzip else body.etag
+
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        data = body.gzipped if use_gzip else body.raw
+        if stream:
+            chunks = (data[i:i + STREAM_CHUNK] for i in range(0, len(data), STREAM_CHUNK))
+            response = Response(chunks, mimetype=mimetype)
+        else:
+            response = Response(data, mimetype=mimetype)
+        response.content_length = len(data)
+        if use_gzip:
+            response.content_encoding = 'gzip'
+
+    response.set_etag(etag)
+    response.vary.add('Accept-Encoding')
+    # Clients may keep the body but must revalidate it
+    response.cache_control.no_cache = True
+    return response
+
+
+@api.before_request
+def _acquire_slot():
+    if not _slots.acquire(blocking=False):
+        return Response('API busy, retry later\n', status=503, headers={'Retry-After': '1'})
+    request.environ['ciq.api_slot'] = True
+
+
+@api.teardown_request
+def _release_slot(exc):
+    if request.environ.pop('ciq.api_slot', False):
+        _slots.release()
+
+
+@api.route('/stations', methods=['GET'])
+def stations():
+    return _respond(serialized().index, 'application/json')
+
+
+@api.route('/stations.ndjson', methods=['GET'])
+def export_stations():
+    return _respond(serialized().ndjson, 'application/x-ndjson', stream=True)
+
+
+@api.route('/stations/<code>', methods=['GET'])
+def station(code):
+    body = serialized().stations.get(code.upper())
+    if body is None:
+        return Response(_dumps({'error': f'Unknown airport code {code.upper()}'}), status=404, mimetype='application/json')
+    return _respond(body, 'application/json')
+
+
+# Re-serialize on the thread that swaps the data, not on the next request
+on_swap(_build)
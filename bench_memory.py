@@ -0,0 +1,100 @@
+"""Memory benchmark: per-worker RSS/PSS for dict records vs. a mapped snapshot.
+
+Starts several worker processes the way gunicorn would, each loading the
+station data and touching every record, then reports memory per worker.
+RSS counts shared pages in full; PSS splits them between the processes
+sharing them, so it shows what the mapped snapshot actually saves.
+
+Usage: python bench_memory.py [stations] [workers]
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from ciq_data import ciq_data
+from ciq_store import load_snapshot, write_snapshot
+
+
+def synthetic_stations(count):
+    """Scale the real dataset up to ``count`` stations, as a multi-base dataset would be."""
+    stations = {}
+    base = list(ciq_data.items())
+    for i in range(count):
+        code, info = base[i % len(base)]
+        stations[f"{code}{i // len(base):03d}"] = dict(info)
+    return stations
+
+
+def memory_kb():
+    """Return (RSS, PSS) of this process in kB."""
+    rss = pss = 0
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                rss = int(line.split()[1])
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            if line.startswith("Pss:"):
+                pss = int(line.split()[1])
+    return rss, pss
+
+
+def worker(mode, path):
+    baseline = memory_kb()
+    if mode == "dict":
+        # Parse from JSON so strings are not shared as code constants
+        with open(path) as f:
+            stations = json.load(f)
+    else:
+        stations = load_snapshot(path)
+    for code in stations:
+        for value in stations[code].values():
+            pass
+    rss, pss = memory_kb()
+    print(json.dumps({"rss": rss - baseline[0], "pss": pss - baseline[1]}), flush=True)
+    # Stay alive until the parent has measured every worker
+    sys.stdin.read()
+
+
+def run(mode, path, workers):
+    procs = [
+        subprocess.Popen(
+            [sys.executable, __file__, "worker", mode, path],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True,
+        )
+        for _ in range(workers)
+    ]
+    results = [json.loads(p.stdout.readline()) for p in procs]
+    for p in procs:
+        p.stdin.close()
+        p.wait()
+    rss = sum(r["rss"] for r in results) / workers
+    pss = sum(r["pss"] for r in results) / workers
+    print(f"{mode:>8}: {rss:8.0f} kB RSS/worker  {pss:8.0f} kB PSS/worker")
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    stations = synthetic_stations(count)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        json_path = os.path.join(tmp, "stations.json")
+        snapshot_path = os.path.join(tmp, "stations.bin")
+        with open(json_path, "w") as f:
+            json.dump(stations, f)
+        write_snapshot(stations, snapshot_path)
+
+        print(f"{count} stations, {workers} workers, snapshot {os.path.getsize(snapshot_path)} bytes")
+        print("(memory added by loading the data, measured while all workers are alive)")
+        run("dict", json_path, workers)
+        run("snapshot", snapshot_path, workers)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "worker":
+        worker(sys.argv[2], sys.argv[3])
+    else:
+        main()
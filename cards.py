@@ -0,0 +1,279 @@
+"""PNG cards of station CIQ information.
+
+Cards are rendered in a background thread whenever the station table is
+loaded or swapped, and cached in ``CIQ_CARD_DIR`` under the hash of the
+record they show. A request only ever looks up a finished card; nothing is
+rendered on the request path. Cards are served from ``/cards/<hash>.png`` and
+linked from replies when ``CIQ_PUBLIC_URL`` (the bot's public https base
+URL) is set.
+
+Rendering needs Pillow; without it the bot simply replies with text.
+"""
+from collections import deque
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+import textwrap
+import threading
+import time
+from io import BytesIO
+
+from flask import abort, send_from_directory
+
+from ciq_format import station_sections
+from ciq_store import current, on_swap
+
+try:
+    from PIL import Image, ImageDraw, ImageFont
+except ImportError:  # Pillow is optional
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+CARD_DIR = os.getenv('CIQ_CARD_DIR', 'card_cache')
+PUBLIC_URL = os.getenv('CIQ_PUBLIC_URL', '').rstrip('/')
+CARD_FONT = os.getenv('CIQ_CARD_FONT')
+
+# Cards are immutable (content-addressed), so clients may cache them for a year
+CARD_MAX_AGE = 365 * 24 * 3600
+# Unreferenced cards are kept this long, as other workers may still link them
+CARD_RETENTION_S = 24 * 3600
+
+# Bump when the layout changes so cached cards are re-rendered
+RENDERER_VERSION = 1
+
+WIDTH = 720
+MARGIN = 32
+HEADER_COLOR = (0, 51, 102)
+TITLE_COLOR = (0, 51, 102)
+TEXT_COLOR = (33, 33, 33)
+BACKGROUND = (255, 255, 255)
+
+_ready = {}  # airport code -> digest of its finished card for the served table
+_build_lock = threading.Lock()
+_priority = deque(maxlen=64)  # codes a running build should render next
+_failed = set()  # digests that failed to render for the served table
+
+
+def card_digest(code, info):
+    """Return the content hash a station's card is cached under."""
+    canonical = json.dumps(
+        {"renderer": RENDERER_VERSION, "code": code, "record": dict(info)},
+        sort_keys=True, ensure_ascii=False, separators=(",", ":"),
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:32]
+
+
+def card_path(digest):
+    return os.path.join(CARD_DIR, f"{digest}.png")
+
+
+def card_url(code):
+    """Return the public URL of a station's card, or None if it is not ready."""
+    digest = _ready.get(code)
+    if digest is None or not PUBLIC_URL:
+        return None
+    return f"{PUBLIC_URL}/cards/{digest}.png"
+
+
+def _font(size):
+    if CARD_FONT:
+        return ImageFont.truetype(CARD_FONT, size)
+    return ImageFont.load_default(size=size)
+
+
+def _wrap(text, font, max_width):
+    """Wrap text to ``max_width`` pixels, keeping explicit line breaks."""
+    lines = []
+    for paragraph in text.split("\n"):
+        words = paragraph.split()
+        line = ""
+        for word in words:
+            candidate = f"{line} {word}" if line else word
+            if line and font.getlength(candidate) > max_width:
+                lines.append(line)
+                line = word
+            else:
+                line = candidate
+        lines.append(line)
+    return lines
+
+
+def render_card(code, info):
+    """Render a station record as PNG bytes."""
+    title_font = _font(40)
+    name_font = _font(24)
+    heading_font = _font(26)
+    body_font = _font(22)
+    text_width = WIDTH - 2 * MARGIN
+
+    # Lay out (font, text, color, top padding) rows, then size the image to fit
+    rows = []
+    for title, lines in station_sections(info):
+        rows.append((heading_font, title, TITLE_COLOR, 20))
+        for line in lines:
+            for i, wrapped in enumerate(_wrap(line, body_font, text_width - 24)):
+                rows.append((body_font, ("• " if i == 0 else "  ") + wrapped, TEXT_COLOR, 4))
+    if info['remark'] and info['remark'].strip():
+        rows.append((heading_font, "REMARK", TITLE_COLOR, 20))
+        for wrapped in _wrap(info['remark'], body_font, text_width):
+            rows.append((body_font, wrapped, TEXT_COLOR, 4))
+
+    name_lines = textwrap.wrap(info['airport_name'], 48) or [""]
+    header_height = MARGIN + 48 + 32 * len(name_lines) + MARGIN // 2
+    height = header_height + sum(font.size + pad + 6 for font, _, _, pad in rows) + MARGIN
+
+    image = Image.new("RGB", (WIDTH, height), BACKGROUND)
+    draw = ImageDraw.Draw(image)
+    draw.rectangle([0, 0, WIDTH, header_height], fill=HEADER_COLOR)
+    draw.text((MARGIN, MARGIN), f"{code} CIQ", font=title_font, fill=BACKGROUND)
+    y = MARGIN + 48
+    for name_line in name_lines:
+        draw.text((MARGIN, y), name_line, font=name_font, fill=BACKGROUND)
+        y += 32
+
+    y = header_height
+    for font, text, color, pad in rows:
+        y += pad
+        draw.text((MARGIN, y), text, font=font, fill=color)
+        y += font.size + 6
+
+    output = BytesIO()
+    image.save(output, format="PNG", optimize=True)
+    return output.getvalue()
+
+
+def _write_card(digest, png):
+    path = card_path(digest)
+    # Every worker renders the same cards at start-up, so each writes through
+    # its own temp file and a card another worker already published is kept
+    fd, tmp_path = tempfile.mkstemp(dir=CARD_DIR, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(png)
+        if not os.path.exists(path):
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _ensure_card(code, info):
+    """Render a station's card unless it is cached; return its digest or None."""
+    digest = card_digest(code, info)
+    if not os.path.exists(card_path(digest)):
+        try:
+            _write_card(digest, render_card(code, info))
+        except Exception:
+            logger.exception("Could not render card for %s", code)
+            _failed.add(digest)
+            return None
+    return digest
+
+
+def _build(table):
+    global _ready
+    with _build_lock:
+        os.makedirs(CARD_DIR, exist_ok=True)
+        # Start from an empty map so changed stations never point at stale cards
+        ready = _ready = {}
+        _failed.clear()
+        remaining = dict.fromkeys(table)
+        while remaining:
+            if current() is not table:
+                return  # superseded by a newer table; its own build takes over
+            code = _next_code(remaining)
+            digest = _ensure_card(code, table[code])
+            if digest is not None:
+                ready[code] = digest
+
+        # Drop old cards no longer referenced by the served table
+        live = {f"{digest}.png" for digest in ready.values()}
+        cutoff = time.time() - CARD_RETENTION_S
+        for name in os.listdir(CARD_DIR):
+            path = os.path.join(CARD_DIR, name)
+            try:
+                if name.endswith(".png") and name not in live and os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                pass
+
+
+def _next_code(remaining):
+    """Pop the next code to render, preferring codes asked for by ``warm()``."""
+    while _priority:
+        code = _priority.popleft()
+        if code in remaining:
+            del remaining[code]
+            return code
+    code = next(iter(remaining))
+    del remaining[code]
+    return code
+
+
+def _build_codes(table, codes):
+    # Only when no prebuild runs; a running one picks the codes from _priority
+    if not _build_lock.acquire(blocking=False):
+        return
+    try:
+        os.makedirs(CARD_DIR, exist_ok=True)
+        ready = _ready
+        for code in codes:
+            if current() is not table:
+                return
+            digest = _ensure_card(code, table[code])
+            if digest is not None:
+                ready[code] = digest
+    finally:
+        _build_lock.release()
+
+
+def warm(codes):
+    """Render these stations' cards soon if they are not ready yet.
+
+    A running prebuild renders them next; otherwise (e.g. a card that failed
+    to render or was removed) they are rendered on a background thread.
+    Cards that already failed for the served table are not retried.
+    """
+    if Image is None:
+        return
+    table = current()
+    missing = [
+        code for code in codes
+        if code in table and code not in _ready and card_digest(code, table[code]) not in _failed
+    ]
+    if not missing:
+        return
+    _priority.extend(missing)
+    if not _build_lock.locked():
+        threading.Thread(target=_build_codes, args=(table, missing), name="ciq-cards-warm", daemon=True).start()
+
+
+def prebuild(table):
+    """Render any missing cards for ``table`` in a background thread."""
+    if Image is None:
+        return
+    threading.Thread(target=_build, args=(table,), name="ciq-cards", daemon=True).start()
+
+
+def send_card(digest):
+    """Serve a cached card with a strong ETag and long-lived cache headers."""
+    if not re.fullmatch(r"[0-9a-f]{32}", digest):
+        abort(404)
+    response = send_from_directory(
+        os.path.abspath(CARD_DIR), f"{digest}.png",
+        mimetype="image/png", etag=digest, max_age=CARD_MAX_AGE, conditional=True,
+    )
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+def start():
+    """Prebuild cards for the served table now and after every swap."""
+    on_swap(prebuild)
+    prebuild(current())
@@ -0,0 +1,175 @@
+"""Formatting of station records into CIQ replies.
+
+``station_sections`` splits a record into titled lists of lines; the chat
+reply, the image cards and any other rendering are built from them.
+``station_reply`` caches chat replies per dataset version.
+"""
+import threading
+
+from ciq_store import current, on_swap
+
+# LINE rejects text messages longer than this, counted in UTF-16 code units
+MAX_REPLY_CHARS = 5000
+
+# Heading icons used in chat replies
+SECTION_ICONS = {
+    "FORMS": "📋",
+    "SPECIAL DOCS": "📄",
+    "ANNOUNCEMENT": "🚨",
+    "OTHER INFO": "ℹ️",
+}
+
+
+def reply_length(text):
+    """Return the length of ``text`` as LINE counts it (UTF-16 code units).
+
+    Emoji outside the Basic Multilingual Plane count twice.
+    """
+    return len(text.encode("utf-16-le")) // 2
+
+
+def announcement_lines(special_announcement):
+    """Split a special announcement into one line per announcement."""
+    lines = []
+
+    # Check if special_announcement is a list (new format) or string (old format)
+    if not special_announcement or special_announcement == "N":
+        # Handle empty case
+        lines.append("None")
+    elif isinstance(special_announcement, list):
+        # New format: Handle list of announcements directly
+        lines.extend(special_announcement)
+    else:
+        # Old format: Handle as string
+        # Special case for HKG
+        if "Smoking(Public Health) Monkeypox Beware of belongings" in special_announcement:
+            lines.append("Public Health - Smoking")
+            lines.append("Monkeypox - Beware belongings")
+        # Check if it's a simple announcement without special formatting needed
+        elif special_announcement.count(' ') < 5 and '&' not in special_announcement and 'trafficking' not in special_announcement:
+            # Simple announcement - don't split it
+            lines.append(special_announcement)
+        else:
+            # More complex announcement that needs parsing
+            announcement_text = special_announcement
+
+            # Handle common separators
+            if " Beware of belongings" in announcement_text:
+                announcement_text = announcement_text.replace(" Beware of belongings", "")
+                has_beware = True
+            else:
+                has_beware = False
+
+            # Check for some common patterns
+            known_phrases = [
+                "Drug trafficking", "Weapon carrying", "Automated Clearance",
+                "Human Trafficking", "Public Health", "Smoking", "Monkeypox",
+                "Customs(FAP)", "Visit Japan Web", "Quarantine", "Currency Declaration",
+                "No Smoking in Terminal", "African Fever", "Dengue Fever"
+            ]
+
+            remaining_text = announcement_text
+            for phrase in known_phrases:
+                if phrase in remaining_text:
+                    lines.append(phrase)
+                    remaining_text = remaining_text.replace(phrase, "")
+
+            # Add any remaining words that weren't matched
+            remaining_words = [w.strip() for w in remaining_text.split() if w.strip()]
+            for word in remaining_words:
+                if word not in ["", "&", "and"]:
+                    lines.append(word)
+
+            if has_beware:
+                lines.append("Beware of belongings")
+
+    return lines
+
+
+def station_sections(info):
+    """Return the ``(title, lines)`` sections shown for a station record."""
+    return [
+        ("FORMS", [
+            f"Immigration - {info['immigration_form']}",
+            f"Customs - {info['customs_form']}",
+            f"Health - {info['health_declaration']}",
+        ]),
+        ("SPECIAL DOCS", [
+            f"Security Checklist - {info['special_document']}",
+            f"A/C Disinsection - {info.get('A/C Disinsection', 'N/A')}",
+            f"GD - {info.get('GD', 'N/A')}",
+        ]),
+        ("ANNOUNCEMENT", announcement_lines(info['special_announcement'])),
+        ("OTHER INFO", [
+            f"Headcount - {info['headcount']}",
+            f"Step Down Imm. - {info['step_down_immigration']}",
+            f"Wheelchair - {info['wchr']}",
+            f"UTC: {info['utc_offset']}",
+        ]),
+    ]
+
+
+def format_section(title, lines):
+    """Format one section as a chat heading followed by bullets."""
+    response = f"{SECTION_ICONS[title]} *{title}:*\n"
+    response += "\n".join(f"• {line}" for line in lines)
+    return response
+
+
+def format_ciq_info(airport_code, stations=None):
+    """Format CIQ information for a given airport code."""
+    if stations is None:
+        stations = current()
+    if airport_code not in stations:
+        return f"Sorry, I don't have information for airport code {airport_code}."
+
+    info = stations[airport_code]
+
+    response = f"✈️ *{airport_code} INFORMATION* ✈️\n\n"
+    response += f"🏢 *{info['airport_name']}*\n\n"
+    response += "\n\n".join(format_section(title, lines) for title, lines in station_sections(info))
+
+    if info['remark'] and info['remark'].strip():
+        response += f"\n\n📝 *REMARK:*\n{info['remark']}"
+
+    return response
+
+
+# (dataset version, {airport code: formatted reply}), replaced as one object
+# and only by warm_replies, so a caller holding an older table can never
+# swap out the replies warmed for the new one
+_replies = (None, {})
+_replies_lock = threading.Lock()
+
+
+def station_reply(airport_code, cached_only=False):
+    """Return ``format_ciq_info`` for the served table, cached per dataset version.
+
+    With ``cached_only`` a reply that is not cached yet returns None instead
+    of being rendered. Until ``warm_replies`` has run for the served table
+    replies are rendered without being cached.
+    """
+    stations = current()
+    version, replies = _replies
+    if version != stations.version:
+        return None if cached_only else format_ciq_info(airport_code, stations)
+    reply = replies.get(airport_code)
+    if reply is None and not cached_only:
+        reply = format_ciq_info(airport_code, stations)
+        # Only real stations are cached, so typos cannot grow the cache
+        if airport_code in stations:
+            replies[airport_code] = reply
+    return reply
+
+
+@on_swap
+def warm_replies(table=None):
+    """Render every station's reply for ``table`` (default: the served one)."""
+    global _replies
+    if table is None:
+        table = current()
+    replies = {code: format_ciq_info(code, table) for code in table}
+    with _replies_lock:
+        # A newer table may have been swapped in (and warmed) meanwhile
+        if table is current():
+            _replies = (table.version, replies)
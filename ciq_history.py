@@ -0,0 +1,222 @@
+"""Append-only change history of the station data.
+
+Each time the served dataset changes, the field-level differences from the
+previous version are appended as one JSON line to ``CIQ_HISTORY_PATH``:
+
+    {"v": 12, "ts": "2026-09-01T03:00:00+00:00", "dataset": "<hash>",
+     "changes": [["KUL", "GD", "2 copies prepared by GS"], ...]}
+
+A value of ``null`` means the field (or, for every field, the station) was
+removed. In memory each ``(station, field)`` keeps its own list of
+``(version, value)`` revisions, so a point-in-time lookup is one bisect per
+field and "changed since N" only visits the revisions after N.
+"""
+from bisect import bisect_right
+from datetime import datetime, time, timezone
+import fcntl
+import json
+import os
+import threading
+
+from ciq_format import MAX_REPLY_CHARS, format_ciq_info, reply_length
+
+HISTORY_PATH = os.getenv('CIQ_HISTORY_PATH', 'ciq_history.jsonl')
+
+
+class HistoryStore:
+    """Field-level revision history of station records, backed by a JSONL file."""
+
+    def __init__(self, path=HISTORY_PATH):
+        self.path = path
+        # Guards the in-memory index: the sync thread records while request
+        # threads query. Reentrant because record() reads the latest dataset
+        self._lock = threading.RLock()
+        self._offset = 0
+        self._timestamps = []  # timestamp of version i + 1
+        self._revisions = []   # changes of version i + 1
+        self._fields = {}      # (code, field) -> ([versions], [values])
+        self._station_fields = {}  # code -> fields that ever existed
+        with self._lock:
+            self._catch_up()
+
+    @property
+    def head(self):
+        """Number of the latest recorded version (0 when empty)."""
+        return len(self._revisions)
+
+    def refresh(self):
+        """Pick up versions recorded by other worker processes."""
+        with self._lock:
+            self._catch_up()
+
+    def _catch_up(self):
+        """Apply entries appended to the file since we last read it."""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb') as f:
+            f.seek(self._offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break  # partially written line; re-read it next time
+                self._offset += len(line)
+                self._apply(json.loads(line))
+
+    def _apply(self, entry):
+        version = entry['v']
+        if version != self.head + 1:
+            raise ValueError(f"History {self.path} jumps from version {self.head} to {version}")
+        self._timestamps.append(datetime.fromisoformat(entry['ts']))
+        self._revisions.append(entry['changes'])
+        for code, field, value in entry['changes']:
+            versions, values = self._fields.setdefault((code, field), ([], []))
+            versions.append(version)
+            values.append(value)
+            fields = self._station_fields.setdefault(code, [])
+            if field not in fields:
+                fields.append(field)
+
+    def _value_at(self, code, field, version):
+        revisions = self._fields.get((code, field))
+        if revisions is None:
+            return None
+        index = bisect_right(revisions[0], version) - 1
+        return revisions[1][index] if index >= 0 else None
+
+    def _latest(self):
+        """Return the latest recorded dataset as ``{code: {field: value}}``."""
+        return {
+            code: record
+            for code in self._station_fields
+            if (record := self.station_at(code, self.head)) is not None
+        }
+
+    def record(self, stations):
+        """Append the changes from the latest version to ``stations``.
+
+        Returns the new version number, or None if nothing changed. Safe to
+        call from several worker processes sharing one history file.
+        """
+        with self._lock, open(self.path, 'a+b') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            # Another worker may have recorded this very change already
+            self._catch_up()
+            latest = self._latest()
+            changes = []
+            for code in stations:
+                record = dict(stations[code])
+                previous = latest.pop(code, {})
+                for field, value in record.items():
+                    if previous.get(field) != value:
+                        changes.append([code, field, value])
+                for field in previous:
+                    if field not in record:
+                        changes.append([code, field, None])
+            for code, previous in latest.items():
+                changes.extend([code, field, None] for field in previous)
+            if not changes:
+                return None
+
+            entry = {
+                'v': self.head + 1,
+                'ts': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                'dataset': getattr(stations, 'version', None),
+                'changes': changes,
+            }
+            line = (json.dumps(entry, ensure_ascii=False) + '\n').encode('utf-8')
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+            self._offset += len(line)
+            self._apply(entry)
+            return entry['v']
+
+    def version_at(self, when):
+        """Return the version that was current at datetime ``when`` (0 if none)."""
+        with self._lock:
+            return bisect_right(self._timestamps, when)
+
+    def timestamp(self, version):
+        with self._lock:
+            return self._timestamps[version - 1]
+
+    def station_at(self, code, version):
+        """Return a station's record as of ``version``, or None if it did not exist."""
+        record = {}
+        with self._lock:
+            for field in self._station_fields.get(code, ()):
+                value = self._value_at(code, field, version)
+                if value is not None:
+                    record[field] = value
+        return record or None
+
+    def changes_since(self, version):
+        """Return ``(version, timestamp, code, field, old, new)`` for later versions."""
+        with self._lock:
+            return [
+                (index + 1, self._timestamps[index], code, field, self._value_at(code, field, index), value)
+                for index in range(max(version, 0), self.head)
+                for code, field, value in self._revisions[index]
+            ]
+
+
+def parse_when(text):
+    """Parse ``2026-09-01`` (end of that day, UTC) or an ISO datetime."""
+    when = datetime.fromisoformat(text)
+    if len(text) == 10:
+        when = datetime.combine(when.date(), time.max)
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return when
+
+
+def format_station_history(history, airport_code, when_text):
+    """Format what the bot would have replied for a station at a given time."""
+    try:
+        when = parse_when(when_text)
+    except ValueError:
+        return f"Sorry, I can't read the date {when_text}. Use e.g. /{airport_code} @2026-09-01."
+
+    history.refresh()
+    version = history.version_at(when)
+    record = history.station_at(airport_code, version) if version else None
+    if record is None:
+        return f"Sorry, I don't have information for airport code {airport_code} as of {when_text}."
+
+    recorded = history.timestamp(version).strftime('%Y-%m-%d %H:%M UTC')
+    response = f"🕘 As of {when_text} (version {version}, recorded {recorded})\n\n"
+    return response + format_ciq_info(airport_code, {airport_code: record})
+
+
+def format_changes(history, since_text):
+    """Format every field change after a given version."""
+    try:
+        since = int(since_text)
+    except ValueError:
+        return f"Sorry, I can't read the version {since_text}. Use e.g. /CHANGES {max(history.head - 1, 0)}."
+
+    history.refresh()
+    if since >= history.head:
+        return f"No changes since version {since} (latest is {history.head})."
+
+    response = f"📝 *CHANGES SINCE VERSION {since}* (latest {history.head})\n"
+    length = reply_length(response)
+    last_version = None
+    for version, timestamp, code, field, old, new in history.changes_since(since):
+        if version != last_version:
+            line = f"\nVersion {version} - {timestamp.strftime('%Y-%m-%d %H:%M UTC')}\n"
+            last_version = version
+        else:
+            line = ""
+        if new is None:
+            line += f"• {code} {field}: removed\n"
+        elif old is None:
+            line += f"• {code} {field}: {new}\n"
+        else:
+            line += f"• {code} {field}: {old} → {new}\n"
+        line_length = reply_length(line)
+        if length + line_length > MAX_REPLY_CHARS - 40:
+            response += "\n… more changes not shown"
+            break
+        response += line
+        length += line_length
+    return response.rstrip('\n')
@@ -0,0 +1,337 @@
+"""Compact, shareable storage for CIQ station records.
+
+Station records are packed into a single binary snapshot: one deduplicated
+string table plus fixed-width rows of uint32 string references. The snapshot
+can be memory-mapped, so every gunicorn worker reads the same physical pages
+instead of holding its own dict-of-dicts copy of ``ciq_data``.
+
+The snapshot lives at ``CIQ_SNAPSHOT`` (default ``ciq_snapshot.bin``). The
+first worker to start writes it from ``ciq_data.py`` when it is missing or
+older than ``ciq_data.py`` (unless the dataset sync wrote it and
+``CIQ_SYNC_URL`` is set); the others wait for it and map the same file.
+``python ciq_store.py build`` writes it ahead of time.
+
+``current()`` returns the table being served; ``swap()`` replaces it and
+notifies the listeners registered with ``on_swap()``.
+"""
+from collections.abc import Mapping
+from contextlib import contextmanager
+import fcntl
+import hashlib
+import importlib.util
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_PATH = os.getenv("CIQ_SNAPSHOT", "ciq_snapshot.bin")
+# With a sync source, a snapshot it wrote holds newer data than ciq_data.py
+KEEP_SYNCED = bool(os.getenv("CIQ_SYNC_URL"))
+
+MAGIC = b"CIQS"
+FORMAT_VERSION = 2
+
+# Header: magic, format version, field count, string count, list count,
+# list item count, station count, string ids of the dataset version and of
+# where the data came from ("" for ciq_data.py).
+_HEADER = struct.Struct("<4sHHIIIIII")
+
+# Cell values in a station row
+MISSING = 0xFFFFFFFF
+LIST_FLAG = 0x80000000
+
+
+def canonical_json(stations):
+    """Serialize a station dataset the same way every time, for hashing."""
+    return json.dumps(stations, sort_keys=True, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def dataset_version(stations):
+    """Return a short content hash identifying a station dataset."""
+    return hashlib.sha256(canonical_json(stations)).hexdigest()[:16]
+
+
+def pack_stations(stations, source=""):
+    """Pack a ``{code: {field: value}}`` dict into snapshot bytes.
+
+    ``source`` records where the data came from, e.g. a sync source version.
+    """
+    fields = []
+    for info in stations.values():
+        for field in info:
+            if field not in fields:
+                fields.append(field)
+
+    strings = {}
+
+    def string_id(value):
+        if value not in strings:
+            strings[value] = len(strings)
+        return strings[value]
+
+    # Field names occupy the first string ids so the snapshot describes itself
+    for field in fields:
+        string_id(field)
+    version_id = string_id(dataset_version(stations))
+    source_id = string_id(source)
+
+    list_offsets = [0]
+    list_items = []
+    rows = []
+    for code, info in stations.items():
+        row = [string_id(code)]
+        for field in fields:
+            if field not in info:
+                row.append(MISSING)
+            elif isinstance(info[field], list):
+                list_items.extend(string_id(item) for item in info[field])
+                row.append(LIST_FLAG | (len(list_offsets) - 1))
+                list_offsets.append(len(list_items))
+            else:
+                row.append(string_id(info[field]))
+        rows.extend(row)
+
+    blob = bytearray()
+    string_offsets = [0]
+    for value in strings:
+        blob += value.encode("utf-8")
+        string_offsets.append(len(blob))
+
+    header = _HEADER.pack(
+        MAGIC, FORMAT_VERSION, len(fields), len(strings),
+        len(list_offsets) - 1, len(list_items), len(stations), version_id, source_id,
+    )
+    return b"".join([
+        header,
+        struct.pack(f"<{len(string_offsets)}I", *string_offsets),
+        struct.pack(f"<{len(list_offsets)}I", *list_offsets),
+        struct.pack(f"<{len(list_items)}I", *list_items),
+        struct.pack(f"<{len(rows)}I", *rows),
+        bytes(blob),
+    ])
+
+
+class StationRecord(Mapping):
+    """Read-only view of one station row; values are decoded on access."""
+
+    __slots__ = ("_table", "_row")
+
+    def __init__(self, table, row):
+        self._table = table
+        self._row = row
+
+    def __getitem__(self, field):
+        index = self._table._field_index.get(field)
+        if index is None:
+            raise KeyError(field)
+        value = self._table._cell(self._row, index)
+        if value is None:
+            raise KeyError(field)
+        return value
+
+    def __iter__(self):
+        for index, field in enumerate(self._table.fields):
+            if self._table._cells[self._row + 1 + index] != MISSING:
+                yield field
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def to_dict(self):
+        """Return a plain dict copy of the record."""
+        return {field: self[field] for field in self}
+
+    def __repr__(self):
+        return f"StationRecord({self.to_dict()!r})"
+
+
+class StationTable(Mapping):
+    """Mapping of airport code to :class:`StationRecord` over snapshot bytes."""
+
+    def __init__(self, buffer):
+        self._buffer = buffer
+        view = memoryview(buffer)
+        if len(view) < _HEADER.size:
+            raise ValueError("Not a CIQ station snapshot")
+        (magic, format_version, n_fields, n_strings, n_lists,
+         n_items, n_stations, version_id, source_id) = _HEADER.unpack_from(view, 0)
+        if magic != MAGIC or format_version != FORMAT_VERSION:
+            raise ValueError("Not a CIQ station snapshot")
+        n_cells = n_strings + 1 + n_lists + 1 + n_items + n_stations * (n_fields + 1)
+        if len(view) < _HEADER.size + 4 * n_cells:
+            raise ValueError("Truncated CIQ station snapshot")
+
+        offset = _HEADER.size
+        self._string_offsets = view[offset:offset + 4 * (n_strings + 1)].cast("I")
+        offset += 4 * (n_strings + 1)
+        self._list_offsets = view[offset:offset + 4 * (n_lists + 1)].cast("I")
+        offset += 4 * (n_lists + 1)
+        self._list_items = view[offset:offset + 4 * n_items].cast("I")
+        offset += 4 * n_items
+        self._stride = n_fields + 1
+        self._cells = view[offset:offset + 4 * n_stations * self._stride].cast("I")
+        offset += 4 * n_stations * self._stride
+        self._blob = view[offset:]
+        if len(self._blob) < self._string_offsets[n_strings]:
+            raise ValueError("Truncated CIQ station snapshot")
+
+        self.fields = tuple(self._string(i) for i in range(n_fields))
+        self._field_index = {field: i for i, field in enumerate(self.fields)}
+        self.version = self._string(version_id)
+        self.source = self._string(source_id)
+        # The code index is the only per-worker structure
+        self._rows = {
+            sys.intern(self._string(self._cells[row * self._stride])): row * self._stride
+            for row in range(n_stations)
+        }
+
+    def _string(self, string_id):
+        start = self._string_offsets[string_id]
+        end = self._string_offsets[string_id + 1]
+        return str(self._blob[start:end], "utf-8")
+
+    def _cell(self, row, index):
+        cell = self._cells[row + 1 + index]
+        if cell == MISSING:
+            return None
+        if cell & LIST_FLAG:
+            list_id = cell & ~LIST_FLAG
+            start = self._list_offsets[list_id]
+            end = self._list_offsets[list_id + 1]
+            return [self._string(item) for item in self._list_items[start:end]]
+        return self._string(cell)
+
+    def __getitem__(self, code):
+        return StationRecord(self, self._rows[code])
+
+    def __contains__(self, code):
+        return code in self._rows
+
+    def __iter__(self):
+        return iter(self._rows)
+
+    def __len__(self):
+        return len(self._rows)
+
+    def to_dict(self):
+        """Return a plain ``{code: {field: value}}`` copy of the table."""
+        return {code: self[code].to_dict() for code in self}
+
+
+def build_table(stations, source=""):
+    """Pack a station dict into an in-memory :class:`StationTable`."""
+    return StationTable(pack_stations(stations, source))
+
+
+@contextmanager
+def snapshot_lock(path):
+    """Hold an exclusive lock on the snapshot at ``path`` across worker processes."""
+    with open(f"{path}.lock", "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        yield
+
+
+def _write_file(data, path):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def write_snapshot(stations, path, source=""):
+    """Write a snapshot file atomically, so mapped readers never see a partial file."""
+    _write_file(pack_stations(stations, source), path)
+
+
+def load_snapshot(path):
+    """Memory-map a snapshot file read-only and return a :class:`StationTable`."""
+    with open(path, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return StationTable(mapped)
+
+
+def _pack_bundled():
+    """Pack ``ciq_data.py`` without keeping its dict-of-dicts imported."""
+    import ciq_data
+    try:
+        return pack_stations(ciq_data.ciq_data)
+    finally:
+        # Modules that import ciq_data later get their own fresh copy
+        sys.modules.pop("ciq_data", None)
+
+
+def load_stations(path=SNAPSHOT_PATH, keep_synced=KEEP_SYNCED):
+    """Map the snapshot at ``path``, writing it from ``ciq_data.py`` first if needed.
+
+    A snapshot older than ``ciq_data.py`` or one that cannot be read is
+    rebuilt with a warning, except that with ``keep_synced`` a snapshot
+    written by the dataset sync is kept. If the snapshot cannot be written
+    the table is packed in memory instead.
+    """
+    spec = importlib.util.find_spec("ciq_data")
+    bundled = spec.origin if spec else None
+    try:
+        with snapshot_lock(path):
+            table = None
+            if os.path.exists(path):
+                try:
+                    table = load_snapshot(path)
+                except (ValueError, struct.error) as e:
+                    # Empty, foreign or from an older FORMAT_VERSION
+                    logger.warning("Snapshot %s is unreadable (%s); rebuilding it", path, e)
+            if (table is not None and bundled and os.path.getmtime(bundled) > os.path.getmtime(path)
+                    and not (keep_synced and table.source)):
+                logger.warning("%s is newer than snapshot %s; rebuilding it", bundled, path)
+                table = None
+            if table is None:
+                _write_file(_pack_bundled(), path)
+                table = load_snapshot(path)
+            return table
+    except OSError as e:
+        logger.warning("Could not use snapshot %s (%s); packing ciq_data.py in memory", path, e)
+        return StationTable(_pack_bundled())
+
+
+_current = None
+_listeners = []
+
+
+def current():
+    """Return the station table the bot is serving, loading it on first use."""
+    global _current
+    if _current is None:
+        _current = load_stations()
+    return _current
+
+
+def swap(table):
+    """Atomically replace the served station table and notify listeners."""
+    global _current
+    _current = table
+    for listener in list(_listeners):
+        try:
+            listener(table)
+        except Exception:
+            # One broken listener must not keep the others from seeing the new data
+            logger.exception("Station table listener %s failed", listener.__name__)
+
+
+def on_swap(listener):
+    """Register ``listener(table)`` to be called whenever the table is swapped."""
+    _listeners.append(listener)
+    return listener
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "build":
+        from ciq_data import ciq_data
+        path = sys.argv[2] if len(sys.argv) > 2 else SNAPSHOT_PATH
+        with snapshot_lock(path):
+            write_snapshot(ciq_data, path)
+        print(f"Wrote {len(ciq_data)} stations to {path} ({os.path.getsize(path)} bytes)")
+    else:
+        print("Usage: python ciq_store.py build [snapshot_path]")
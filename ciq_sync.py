@@ -0,0 +1,269 @@
+"""Background sync of the station dataset from a central HTTP source.
+
+Every ``CIQ_SYNC_INTERVAL_S`` seconds the bot polls ``CIQ_SYNC_URL`` with
+``If-None-Match``/``If-Modified-Since``; an unchanged source answers 304 and
+costs only headers. The source serves the full dataset as
+
+    {"version": "42", "sha256": "<hex>", "stations": {"KUL": {...}, ...}}
+
+Once a version is known the bot asks for ``?since=<version>``. A source that
+supports deltas answers with only what changed,
+
+    {"base": "41", "version": "42", "sha256": "<hex>",
+     "changed": {"KUL": {...}}, "removed": ["BWA"]}
+
+and a source that does not simply ignores the parameter. ``sha256`` is the
+hash of the complete resulting dataset in ``ciq_store.canonical_json`` form,
+so deltas are verified exactly like full downloads. A verified dataset is
+written to the snapshot file (when given) and swapped in atomically with
+``ciq_store.swap``.
+
+With a snapshot file only one process polls the source: the worker holding
+an flock on ``<snapshot>.sync`` fetches and writes the snapshot, and the
+others map it again when it changes, so every worker keeps sharing one
+physical copy. When the leader exits, another worker takes over.
+
+Sync runs on its own thread; failures are counted and logged and the bot
+keeps serving the data it has.
+"""
+import fcntl
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from ciq_store import (
+    build_table, canonical_json, current, dataset_version, load_snapshot, snapshot_lock, swap, write_snapshot,
+)
+
+SYNC_URL = os.getenv('CIQ_SYNC_URL')
+SYNC_INTERVAL_S = float(os.getenv('CIQ_SYNC_INTERVAL_S', '300'))
+SYNC_TIMEOUT_S = float(os.getenv('CIQ_SYNC_TIMEOUT_S', '10'))
+
+logger = logging.getLogger(__name__)
+
+
+class SyncError(Exception):
+    """The source sent something we cannot apply."""
+
+
+def checksum(stations):
+    """Return the sha256 hex digest a source publishes for a dataset."""
+    return hashlib.sha256(canonical_json(stations)).hexdigest()
+
+
+class DatasetSync:
+    """Polls a dataset source and swaps verified updates into the bot."""
+
+    def __init__(self, url, interval=SYNC_INTERVAL_S, timeout=SYNC_TIMEOUT_S, snapshot_path=None):
+        self.url = url
+        self.interval = interval
+        self.timeout = timeout
+        self.snapshot_path = snapshot_path
+        self._etag = None
+        self._last_modified = None
+        self._source_version = None
+        self._stations = None  # last applied dataset, the base for deltas
+        self._leader_file = None  # open and flock'd while this process polls the source
+        self._snapshot_stat = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._stats = {
+            'checks': 0,
+            'not_modified': 0,
+            'full_updates': 0,
+            'delta_updates': 0,
+            'failures': 0,
+            'reloads': 0,
+            'bytes_fetched': 0,
+            'last_fetch_bytes': 0,
+            'last_success': None,
+            'last_update': None,
+            'last_error': None,
+        }
+
+    def stats(self):
+        """Return sync counters plus the current lag behind the source."""
+        stats = dict(self._stats)
+        stats['leader'] = self._leader_file is not None or not self.snapshot_path
+        stats['source_version'] = self._source_version
+        stats['dataset_version'] = current().version
+        last_success = stats['last_success']
+        stats['lag_s'] = round(time.time() - last_success, 1) if last_success else None
+        return stats
+
+    def _request_url(self):
+        if self._source_version is None or self._stations is None:
+            return self.url
+        separator = '&' if urllib.parse.urlsplit(self.url).query else '?'
+        return f"{self.url}{separator}since={urllib.parse.quote(str(self._source_version))}"
+
+    def _fetch(self):
+        """Return (status, headers, body bytes) of one conditional GET."""
+        headers = {'Accept': 'application/json', 'Accept-Encoding': 'gzip'}
+        if self._etag:
+            headers['If-None-Match'] = self._etag
+        if self._last_modified:
+            headers['If-Modified-Since'] = self._last_modified
+        request = urllib.request.Request(self._request_url(), headers=headers)
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return response.status, response.headers, response.read()
+        except urllib.error.HTTPError as e:
+            if e.code == 304:
+                return 304, e.headers, b''
+            raise
+
+    def sync_once(self):
+        """Check the source once; return True if new data was swapped in."""
+        self._stats['checks'] += 1
+        status, headers, body = self._fetch()
+        self._stats['last_fetch_bytes'] = len(body)
+        self._stats['bytes_fetched'] += len(body)
+        if status == 304:
+            self._stats['not_modified'] += 1
+            self._stats['last_success'] = time.time()
+            return False
+
+        if headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        document = json.loads(body)
+
+        if 'stations' in document:
+            stations = document['stations']
+            kind = 'full_updates'
+        elif 'changed' in document or 'removed' in document:
+            if document.get('base') != self._source_version or self._stations is None:
+                # Our base is not the one the delta applies to; start over
+                message = f"Delta base {document.get('base')} does not match {self._source_version}"
+                self._reset()
+                raise SyncError(message)
+            stations = dict(self._stations)
+            stations.update(document.get('changed', {}))
+            for code in document.get('removed', []):
+                stations.pop(code, None)
+            kind = 'delta_updates'
+        else:
+            raise SyncError("Response has neither 'stations' nor a delta")
+
+        expected = document.get('sha256')
+        if expected is None or checksum(stations) != expected:
+            self._reset()
+            raise SyncError(f"Checksum mismatch for version {document.get('version')}")
+
+        self._etag = headers.get('ETag')
+        self._last_modified = headers.get('Last-Modified')
+        self._source_version = document.get('version')
+        self._stations = stations
+        self._stats['last_success'] = time.time()
+
+        served = current()
+        # Also take over a snapshot of the same data written from ciq_data.py,
+        # so a restart keeps it as synced data
+        if dataset_version(stations) != served.version or (self.snapshot_path and not served.source):
+            self._apply(stations)
+            self._stats[kind] += 1
+            self._stats['last_update'] = time.time()
+            return True
+        return False
+
+    def _reset(self):
+        """Forget the source state so the next check downloads everything."""
+        self._source_version = None
+        self._etag = self._last_modified = None
+
+    def _apply(self, stations):
+        source = f"sync:{self._source_version}"
+        if self.snapshot_path:
+            with snapshot_lock(self.snapshot_path):
+                # Keep a file that already holds this version; rewriting it would
+                # leave workers mapping different copies of the same data
+                if not self._snapshot_holds(dataset_version(stations)):
+                    write_snapshot(stations, self.snapshot_path, source)
+                table = load_snapshot(self.snapshot_path)
+            self._snapshot_stat = self._stat_snapshot()
+        else:
+            table = build_table(stations, source)
+        swap(table)
+        logger.info('Swapped in station dataset %s (%d stations)', table.version, len(table))
+
+    def _snapshot_holds(self, version):
+        """Return True if the snapshot file already holds this synced version."""
+        try:
+            table = load_snapshot(self.snapshot_path)
+        except (OSError, ValueError):
+            return False
+        return table.version == version and bool(table.source)
+
+    def _stat_snapshot(self):
+        try:
+            stat = os.stat(self.snapshot_path)
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns
+
+    def _lead(self):
+        """Return True if this process polls the source, taking over if it is free."""
+        if self._leader_file is None:
+            f = open(f"{self.snapshot_path}.sync", 'a')
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                f.close()
+                return False
+            self._leader_file = f
+            logger.info('Polling %s for this machine (pid %d)', self.url, os.getpid())
+        return True
+
+    def _release(self):
+        if self._leader_file is not None:
+            self._leader_file.close()
+            self._leader_file = None
+
+    def reload(self):
+        """Map the snapshot again if the leader replaced it; return True on a swap."""
+        stat = self._stat_snapshot()
+        if stat is None or stat == self._snapshot_stat:
+            return False
+        self._snapshot_stat = stat
+        table = load_snapshot(self.snapshot_path)
+        served = current()
+        if table.version == served.version and table.source == served.source:
+            return False
+        swap(table)
+        self._stats['reloads'] += 1
+        self._stats['last_update'] = time.time()
+        logger.info('Mapped station dataset %s written by the sync leader', table.version)
+        return True
+
+    def check(self):
+        """Sync from the source if this process leads, else follow the leader's snapshot."""
+        if self.snapshot_path and not self._lead():
+            return self.reload()
+        return self.sync_once()
+
+    def run(self):
+        while not self._stop.is_set():
+            try:
+                self.check()
+            except Exception as e:
+                self._stats['failures'] += 1
+                self._stats['last_error'] = f"{type(e).__name__}: {e}"
+                logger.warning('Station sync from %s failed: %s', self.url, e)
+            self._stop.wait(self.interval)
+
+    def start(self):
+        """Start polling on a daemon thread."""
+        self._thread = threading.Thread(target=self.run, name='ciq-sync', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop polling and hand the source over to another worker."""
+        self._stop.set()
+        self._release()
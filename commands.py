@@ -0,0 +1,148 @@
+"""Table-driven routing of slash commands.
+
+Commands register with ``@router.command('NAME')`` and are looked up by
+their upper-cased first token in a dict, so dispatch cost does not grow
+with the number of commands. Any other ``/TOKEN`` goes to the handler
+registered with ``@router.default()`` (the station lookup). Text that does
+not start with ``/`` returns before anything is allocated.
+
+Middleware hooks have the signature ``hook(ctx, call_next)`` and are composed
+around each handler once, at registration, not per message.
+"""
+import functools
+import logging
+import threading
+import time
+
+from linebot.models import TextSendMessage
+
+from profiling import phase
+
+logger = logging.getLogger(__name__)
+
+
+class CommandContext:
+    """One parsed command: ``/COMMAND args`` plus the LINE event it came from."""
+
+    __slots__ = ('command', 'args', 'event')
+
+    def __init__(self, command, args, event=None):
+        self.command = command
+        self.args = args
+        self.event = event
+
+    @property
+    def user_id(self):
+        return getattr(getattr(self.event, 'source', None), 'user_id', None)
+
+    @property
+    def chat_id(self):
+        """Group or room the command was sent in, else the user for 1:1 chats."""
+        source = getattr(self.event, 'source', None)
+        return getattr(source, 'group_id', None) or getattr(source, 'room_id', None) or self.user_id
+
+
+class CommandRouter:
+    """Dispatch table of command handlers with per-command middleware."""
+
+    def __init__(self):
+        self._middleware = []
+        self._handlers = {}  # command -> (handler, hooks)
+        self._table = {}     # command -> composed callable
+        self._default = None
+        self._default_handler = None
+
+    def use(self, hook):
+        """Add a middleware hook applied to every command."""
+        self._middleware.append(hook)
+        self._compose_all()
+        return hook
+
+    def command(self, name, *hooks):
+        """Decorator registering ``handler(ctx)`` for ``/NAME``."""
+        def decorator(handler):
+            self._handlers[name.upper()] = (handler, hooks)
+            self._table[name.upper()] = self._compose(handler, hooks)
+            return handler
+        return decorator
+
+    def default(self, *hooks):
+        """Decorator registering the handler for ``/TOKEN`` without a command."""
+        def decorator(handler):
+            self._default_handler = (handler, hooks)
+            self._default = self._compose(handler, hooks)
+            return handler
+        return decorator
+
+    def _compose(self, handler, hooks):
+        call = handler
+        # The first hook listed ends up outermost
+        for hook in reversed(tuple(self._middleware) + tuple(hooks)):
+            call = functools.partial(_call_hook, hook, call)
+        return call
+
+    def _compose_all(self):
+        self._table = {name: self._compose(*entry) for name, entry in self._handlers.items()}
+        if self._default_handler is not None:
+            self._default = self._compose(*self._default_handler)
+
+    def dispatch(self, text, event=None):
+        """Run the handler for ``text`` and return its result.
+
+        Returns None, without any work, for text that is not a command.
+        """
+        if not text.lstrip().startswith('/'):
+            return None
+        command, _, args = text.strip().upper()[1:].partition(' ')
+        call = self._table.get(command, self._default)
+        if call is None:
+            return None
+        return call(CommandContext(command, args.strip(), event))
+
+
+def _call_hook(hook, call_next, ctx):
+    return hook(ctx, call_next)
+
+
+def timed(ctx, call_next):
+    """Middleware: time the command as the request's ``format`` phase."""
+    with phase('format'):
+        return call_next(ctx)
+
+
+def handle_errors(ctx, call_next):
+    """Middleware: log a failing command and apologise instead of raising."""
+    try:
+        return call_next(ctx)
+    except Exception:
+        logger.exception('Command /%s failed', ctx.command)
+        return [TextSendMessage(text="Sorry, something went wrong. Please try again.")]
+
+
+def rate_limit(per_minute, burst=None):
+    """Middleware factory: a token bucket per user, dropping commands over the limit."""
+    capacity = burst or per_minute
+    rate = per_minute / 60.0
+    buckets = {}  # user id -> (tokens, last refill)
+    lock = threading.Lock()
+
+    def hook(ctx, call_next):
+        key = ctx.user_id
+        if key is None:
+            return call_next(ctx)
+        now = time.monotonic()
+        with lock:
+            tokens, last = buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - last) * rate)
+            if tokens < 1:
+                buckets[key] = (tokens, now)
+                logger.info('Rate limited /%s from %s', ctx.command, key)
+                return None
+            buckets[key] = (tokens - 1, now)
+            if len(buckets) > 10000:
+                # Full buckets carry no state; forget them
+                for user, (user_tokens, user_last) in list(buckets.items()):
+                    if user_tokens + (now - user_last) * rate >= capacity:
+                        del buckets[user]
+        return call_next(ctx)
+    return hook
@@ -1,9 +1,24 @@
-from flask import Flask, request, abort
-from linebot import LineBotApi, WebhookHandler
+from flask import Flask, request, abort, jsonify
+from linebot import LineBotApi
 from linebot.exceptions import InvalidSignatureError
-from linebot.models import MessageEvent, TextMessage, TextSendMessage
+from linebot.models import (
+    MessageEvent, TextMessage, TextSendMessage, ImageSendMessage,
+    QuickReply, QuickReplyButton, MessageAction,
+)
 import os
-from ciq_data import ciq_data
+import difflib
+from ciq_format import format_ciq_info, station_reply, warm_replies
+import cards
+from api import api, serialized
+from ciq_store import SNAPSHOT_PATH, current, on_swap
+from ciq_history import HistoryStore, format_changes, format_station_history
+from pairing import format_pairing
+from ciq_sync import SYNC_URL, DatasetSync
+from profiling import profile_request, phase
+from dispatch import ConcurrentWebhookHandler
+from commands import CommandRouter, handle_errors, rate_limit, timed
+from admission import DEGRADED, SHED, AdmissionController, has_command
+from usage import UsageModel
 from dotenv import load_dotenv
 import sys
 
@@ -16,138 +31,188 @@ app = Flask(__name__)
 LINE_CHANNEL_ACCESS_TOKEN = os.getenv('LINE_CHANNEL_ACCESS_TOKEN')
 LINE_CHANNEL_SECRET = os.getenv('LINE_CHANNEL_SECRET')
 
+# Events in one webhook body are handled concurrently; the webhook is acked
+# after CIQ_BATCH_DEADLINE_S even if some replies are still in flight
+DISPATCH_WORKERS = int(os.getenv('CIQ_DISPATCH_WORKERS', '4'))
+BATCH_DEADLINE_S = float(os.getenv('CIQ_BATCH_DEADLINE_S', '1.0'))
+
 line_bot_api = LineBotApi(LINE_CHANNEL_ACCESS_TOKEN)
-handler = WebhookHandler(LINE_CHANNEL_SECRET)
+handler = ConcurrentWebhookHandler(LINE_CHANNEL_SECRET, max_workers=DISPATCH_WORKERS, deadline=BATCH_DEADLINE_S)
 
-def format_ciq_info(airport_code):
-    """Format CIQ information for a given airport code."""
-    if airport_code not in ciq_data:
-        return f"Sorry, I don't have information for airport code {airport_code}."
-    
-    info = ciq_data[airport_code]
-    
-    response = f"✈️ *{airport_code} INFORMATION* ✈️\n\n"
-    response += f"🏢 *{info['airport_name']}*\n\n"
-    
-    response += "📋 *FORMS:*\n"
-    response += f"• Immigration - {info['immigration_form']}\n"
-    response += f"• Customs - {info['customs_form']}\n"
-    response += f"• Health - {info['health_declaration']}\n\n"
-    
-    response += "📄 *SPECIAL DOCS:*\n"
-    response += f"• Security Checklist - {info['special_document']}\n"
-    response += f"• A/C Disinsection - {info.get('A/C Disinsection', 'N/A')}\n"
-    response += f"• GD - {info.get('GD', 'N/A')}\n\n"
-    
-    response += "🚨 *ANNOUNCEMENT:*\n"
-    
-    # Check if special_announcement is a list (new format) or string (old format)
-    special_announcement = info['special_announcement']
-    
-    if not special_announcement or special_announcement == "N":
-        # Handle empty case
-        response += "• None\n"
-    elif isinstance(special_announcement, list):
-        # New format: Handle list of announcements directly
-        for announcement in special_announcement:
-            response += f"• {announcement}\n"
-    else:
-        # Old format: Handle as string
-        # Special case for HKG
-        if "Smoking(Public Health) Monkeypox Beware of belongings" in special_announcement:
-            response += "• Public Health - Smoking\n"
-            response += "• Monkeypox - Beware belongings\n"
-        # Check if it's a simple announcement without special formatting needed
-        elif special_announcement.count(' ') < 5 and '&' not in special_announcement and 'trafficking' not in special_announcement:
-            # Simple announcement - don't split it
-            response += f"• {special_announcement}\n"
-        else:
-            # More complex announcement that needs parsing
-            announcement_text = special_announcement
-            
-            # Handle common separators
-            if " Beware of belongings" in announcement_text:
-                announcement_text = announcement_text.replace(" Beware of belongings", "")
-                has_beware = True
-            else:
-                has_beware = False
-                
-            # Try to identify items separated by spaces that should be together
-            phrases = []
-            
-            # Check for some common patterns
-            known_phrases = [
-                "Drug trafficking", "Weapon carrying", "Automated Clearance",
-                "Human Trafficking", "Public Health", "Smoking", "Monkeypox",
-                "Customs(FAP)", "Visit Japan Web", "Quarantine", "Currency Declaration",
-                "No Smoking in Terminal", "African Fever", "Dengue Fever"
-            ]
-            
-            remaining_text = announcement_text
-            for phrase in known_phrases:
-                if phrase in remaining_text:
-                    phrases.append(phrase)
-                    remaining_text = remaining_text.replace(phrase, "")
-            
-            # Add any remaining words that weren't matched
-            remaining_words = [w.strip() for w in remaining_text.split() if w.strip()]
-            for word in remaining_words:
-                if word not in ["", "&", "and"]:
-                    phrases.append(word)
-            
-            # Output the formatted announcements
-            for phrase in phrases:
-                response += f"• {phrase}\n"
-                
-            if has_beware:
-                response += "• Beware of belongings\n"
-    
-    response += "\nℹ️ *OTHER INFO:*\n"
-    response += f"• Headcount - {info['headcount']}\n"
-    response += f"• Step Down Imm. - {info['step_down_immigration']}\n"
-    response += f"• Wheelchair - {info['wchr']}\n"
-    response += f"• UTC: {info['utc_offset']}"
-    
-    if info['remark'] and info['remark'].strip():
-        response += f"\n\n📝 *REMARK:*\n{info['remark']}"
-    
-    return response
+# Overload protection for /callback; replies still running count as load.
+# Station replies are pre-rendered so they can still be sent when degraded
+admission = AdmissionController(backlog=lambda: handler.pending)
+warm_replies()
+
+# Render station cards in the background; replies only link finished ones
+cards.start()
+
+# Read-only JSON API, serialized up front so requests only copy bytes
+app.register_blueprint(api)
+serialized()
+
+# Field-level change history, appended whenever the served data changes.
+# With a sync source only synced data is recorded; the bundled data a fresh
+# worker starts from would otherwise show up as changes the sync reverts
+history = HistoryStore()
+
+@on_swap
+def record_history(table):
+    if SYNC_URL and not table.source:
+        return None
+    return history.record(table)
+
+record_history(current())
+
+# Poll the central dataset source in the background when configured; one
+# worker polls and writes the shared snapshot, the others map it
+syncer = None
+if SYNC_URL:
+    syncer = DatasetSync(SYNC_URL, snapshot_path=SNAPSHOT_PATH)
+    syncer.start()
 
 @app.route("/", methods=['GET'])
 def home():
     return "Line Bot is running!"
 
+@app.route("/metrics", methods=['GET'])
+def metrics():
+    return jsonify({
+        'dataset_version': current().version,
+        'stations': len(current()),
+        'sync': syncer.stats() if syncer else None,
+        'admission': admission.stats(),
+        'usage_keys': len(usage),
+    })
+
+@app.route("/cards/<digest>.png", methods=['GET'])
+def card_image(digest):
+    return cards.send_card(digest)
+
 @app.route("/callback", methods=['POST'])
+@profile_request
 def callback():
-    # Get X-Line-Signature header value
-    signature = request.headers['X-Line-Signature']
-
-    # Get request body as text
-    body = request.get_data(as_text=True)
-    app.logger.info("Request body: " + body)
+    # Shed with a fast 503 before touching the body when overloaded
+    level = admission.admit(request.headers.get('X-Request-Start'))
+    if level == SHED:
+        return 'Busy', 503, {'Retry-After': '1'}
 
     try:
-        handler.handle(body, signature)
-    except InvalidSignatureError:
-        abort(400)
+        # Get X-Line-Signature header value
+        signature = request.headers['X-Line-Signature']
+
+        # Get request body as text
+        body = request.get_data(as_text=True)
+        app.logger.info("Request body: " + body)
+
+        if level == DEGRADED:
+            # Ack bodies without any command before the SDK parses them
+            if not handler.parser.signature_validator.validate(body, signature):
+                abort(400)
+            if not has_command(body):
+                admission.count('skipped_early')
+                return 'OK'
+
+        try:
+            with phase('handle'):
+                handler.handle(body, signature)
+        except InvalidSignatureError:
+            abort(400)
+
+        return 'OK'
+    finally:
+        admission.release()
+
+def skip_when_degraded(ctx, call_next):
+    """Middleware: drop commands that have no cached reply while overloaded."""
+    if admission.degraded():
+        admission.count('dropped_uncached')
+        return None
+    return call_next(ctx)
 
-    return 'OK'
+# Stations each chat and user asks for, to offer them as quick replies
+QUICK_REPLY_COUNT = int(os.getenv('CIQ_QUICK_REPLY_COUNT', '4'))
+usage = UsageModel()
+
+def suggest_stations(ctx, airport_code):
+    """Record a station query and return the stations to offer next."""
+    stations = current()
+    keys = [('user', ctx.user_id)] if ctx.user_id else []
+    if ctx.chat_id and ctx.chat_id != ctx.user_id:
+        keys.append(('chat', ctx.chat_id))
+    if airport_code in stations:
+        usage.record(keys, airport_code)
+    suggestions = [
+        code for code in usage.suggest(keys, exclude=(airport_code,), limit=QUICK_REPLY_COUNT)
+        if code in stations
+    ]
+    if airport_code not in stations:
+        # Probably a typo; offer the closest codes as well
+        for code in difflib.get_close_matches(airport_code, stations, n=QUICK_REPLY_COUNT, cutoff=0.6):
+            if code not in suggestions and len(suggestions) < QUICK_REPLY_COUNT:
+                suggestions.append(code)
+    return suggestions
+
+# Slash commands; every command is timed, rate limited per user and
+# answers with an apology instead of failing the webhook
+RATE_LIMIT_PER_MIN = int(os.getenv('CIQ_RATE_LIMIT_PER_MIN', '30'))
+
+router = CommandRouter()
+router.use(timed)
+router.use(handle_errors)
+router.use(rate_limit(RATE_LIMIT_PER_MIN))
+
+@router.command('CHANGES', skip_when_degraded)
+def changes_command(ctx):
+    """/CHANGES 12 lists every change after version 12."""
+    return [TextSendMessage(text=format_changes(history, ctx.args))]
+
+@router.command('PAIRING', skip_when_degraded)
+def pairing_command(ctx):
+    """/PAIRING DMK-KUL-DMK-SIN-DMK briefs every destination in one reply."""
+    return [TextSendMessage(text=format_pairing(ctx.args))]
+
+@router.default()
+def station_command(ctx):
+    """/KUL shows a station; /KUL @2026-09-01 shows it as it was on that date."""
+    airport_code = ctx.command
+    if ctx.args.startswith('@'):
+        return skip_when_degraded(ctx, lambda ctx: [
+            TextSendMessage(text=format_station_history(history, airport_code, ctx.args[1:].strip()))
+        ])
+
+    # While overloaded only replies that are already rendered are sent
+    response = station_reply(airport_code, cached_only=admission.degraded())
+    if response is None:
+        admission.count('dropped_uncached')
+        return None
+
+    messages = [TextSendMessage(text=response)]
+    card = cards.card_url(airport_code)
+    if card:
+        messages.append(ImageSendMessage(original_content_url=card, preview_image_url=card))
+
+    suggestions = suggest_stations(ctx, airport_code)
+    if suggestions:
+        # LINE shows quick replies of the last message only
+        messages[-1].quick_reply = QuickReply(items=[
+            QuickReplyButton(action=MessageAction(label=f"/{code}", text=f"/{code}"))
+            for code in suggestions
+        ])
+        if not admission.degraded():
+            # Replies are all pre-rendered on every swap; cards normally are
+            # too, so this only renders cards that are missing or still queued
+            cards.warm(suggestions)
+    return messages
 
 @handler.add(MessageEvent, message=TextMessage)
 def handle_message(event):
-    text = event.message.text.strip().upper()
-    
-    # Check if the message starts with '/'
-    if text.startswith('/'):
-        airport_code = text[1:]  # Remove the '/' and get the airport code
-        response = format_ciq_info(airport_code)
-        
-        line_bot_api.reply_message(
-            event.reply_token,
-            TextSendMessage(text=response)
-        )
-    # If text doesn't start with '/', don't send any response
-    # This allows other conversations to happen without showing an error
+    # Text that doesn't start with '/' gets no response, so other
+    # conversations can happen without showing an error
+    messages = router.dispatch(event.message.text, event)
+    if messages:
+        with phase('reply'):
+            line_bot_api.reply_message(event.reply_token, messages)
 
 def run_local_test():
     """Run a local test of the bot without using the Line API."""
@@ -157,16 +222,15 @@ def run_local_test():
     
     while True:
         try:
-            user_input = input("\nEnter command: ").strip().upper()
+            user_input = input("\nEnter command: ").strip()
             
             if user_input.lower() == 'exit':
                 print("Goodbye!")
                 break
             
-            if user_input.startswith('/'):
-                airport_code = user_input[1:]
-                response = format_ciq_info(airport_code)
-                print("\n" + response)
+            for message in router.dispatch(user_input) or []:
+                if isinstance(message, TextSendMessage):
+                    print("\n" + message.text)
             # If user input doesn't start with '/', don't show any message
             # This allows other conversations to happen without showing an error
         except KeyboardInterrupt:
@@ -0,0 +1,129 @@
+"""Consolidated CIQ brief for a multi-sector pairing.
+
+``/PAIRING DMK-KUL-DMK-SIN-DMK`` lists every sector's destination once, in
+sector order. Lines that read the same for every station (most stations
+have "N" forms and the same security checklist) are folded into one shared
+block, so each station only lists what differs.
+
+Each station's lines are split into fragments once per dataset version and
+cached, so a brief is a few set operations and string joins.
+"""
+import re
+
+from ciq_format import MAX_REPLY_CHARS, SECTION_ICONS, reply_length, station_sections
+from ciq_store import current, on_swap
+
+# Longer routes and lists of unknown codes are cut short with "…"
+MAX_LISTED_SECTORS = 16
+MAX_LISTED_UNKNOWN = 10
+
+# (dataset version, {airport code: (airport name, ((section, line), ...), remark)}),
+# replaced as one object so a fragment is never filed under another version
+_fragments = (None, {})
+
+
+def _fragment_cache(stations):
+    """Return the fragment dict for ``stations``, taken once per brief."""
+    global _fragments
+    version, cache = _fragments
+    if version == stations.version:
+        return cache
+    cache = {}
+    if stations is current():
+        _fragments = (stations.version, cache)
+    # A table that is no longer served gets a throwaway cache
+    return cache
+
+
+def _station_fragments(stations, cache, code):
+    fragments = cache.get(code)
+    if fragments is None:
+        info = stations[code]
+        lines = tuple(
+            (title, line)
+            for title, section_lines in station_sections(info)
+            for line in section_lines
+        )
+        remark = info['remark'].strip() if info['remark'] else ""
+        fragments = cache[code] = (info['airport_name'], lines, remark)
+    return fragments
+
+
+def _clear_fragments(table):
+    global _fragments
+    _fragments = (table.version, {})
+
+
+on_swap(_clear_fragments)
+
+
+def _format_lines(lines):
+    """Group (section, line) fragments back under their section headings."""
+    response = ""
+    section = None
+    for title, line in lines:
+        if title != section:
+            response += f"{SECTION_ICONS[title]} *{title}:*\n"
+            section = title
+        response += f"• {line}\n"
+    return response
+
+
+def _shorten(items, limit, separator):
+    """Join at most ``limit`` items, noting how many were left out."""
+    if len(items) <= limit:
+        return separator.join(items)
+    return f"{separator.join(items[:limit])}{separator}… ({len(items) - limit} more)"
+
+
+def format_pairing(route, stations=None):
+    """Format one brief covering every destination of a pairing.
+
+    The brief always fits one LINE message; stations that do not fit are
+    left for their own ``/CODE`` lookup.
+    """
+    if stations is None:
+        stations = current()
+    codes = [code for code in re.split(r"[\s,>/-]+", route.upper()) if code]
+    if len(codes) < 2:
+        return "Please give the pairing as stations separated by '-', e.g. /PAIRING DMK-KUL-DMK-SIN-DMK"
+
+    # Each sector's destination, first visit only, in sector order
+    destinations = list(dict.fromkeys(codes[1:]))
+    known = [code for code in destinations if code in stations]
+    unknown = [code for code in destinations if code not in stations]
+    cache = _fragment_cache(stations)
+    fragments = {code: _station_fragments(stations, cache, code) for code in known}
+
+    shared = set()
+    if len(known) > 1:
+        shared = set(fragments[known[0]][1]).intersection(*(fragments[code][1] for code in known[1:]))
+
+    sectors = [f"{a}→{b}" for a, b in zip(codes, codes[1:])]
+    response = f"✈️ *PAIRING {_shorten(codes, MAX_LISTED_SECTORS + 1, '-')}* ✈️\n"
+    response += f"Sectors: {_shorten(sectors, MAX_LISTED_SECTORS, ', ')}\n"
+
+    if shared:
+        ordered = [fragment for fragment in fragments[known[0]][1] if fragment in shared]
+        response += f"\n🔁 *ALL STATIONS ({', '.join(known)}):*\n"
+        response += _format_lines(ordered)
+
+    trailer = f"\nNo CIQ information for: {_shorten(unknown, MAX_LISTED_UNKNOWN, ', ')}" if unknown else ""
+    # Room for the trailer and a note about stations left out
+    budget = MAX_REPLY_CHARS - reply_length(trailer) - 80
+    length = reply_length(response)
+    for code in known:
+        name, lines, remark = fragments[code]
+        block = f"\n📍 *{code} - {name}*\n"
+        different = [fragment for fragment in lines if fragment not in shared]
+        block += _format_lines(different) if different else "• Same as all stations\n"
+        if remark:
+            block += f"📝 *REMARK:*\n{remark}\n"
+        block_length = reply_length(block)
+        if length + block_length > budget:
+            response += f"\n… brief too long; use /{code} for the remaining stations\n"
+            break
+        response += block
+        length += block_length
+
+    return (response + trailer).rstrip("\n")
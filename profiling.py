@@ -0,0 +1,291 @@
+"""Opt-in sampling profiler for webhook requests.
+
+A background thread samples the stacks of threads that are serving a
+profiled request every ``CIQ_PROFILE_INTERVAL_MS``. When the request ends
+its profile is kept if it was picked by ``CIQ_PROFILE_SAMPLE_RATE`` or took
+longer than ``CIQ_PROFILE_SLOW_MS``, and written (off the request path) to
+``CIQ_PROFILE_DIR`` together with a per-phase timing breakdown. A phase's
+time is the wall-clock time during which at least one thread was in it, so
+phases run concurrently on pool threads never add up past the request
+total. Only the newest ``CIQ_PROFILE_KEEP`` profiles are kept.
+
+With neither rate nor threshold set the decorator returns the function
+unchanged and ``phase()`` is a shared no-op, so nothing runs per request.
+
+Aggregate captured profiles with ``python profiling.py top``.
+"""
+from collections import Counter
+import functools
+import itertools
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+PROFILE_SAMPLE_RATE = float(os.getenv('CIQ_PROFILE_SAMPLE_RATE', '0'))
+PROFILE_SLOW_MS = float(os.getenv('CIQ_PROFILE_SLOW_MS', '0'))
+PROFILE_INTERVAL_MS = float(os.getenv('CIQ_PROFILE_INTERVAL_MS', '5'))
+PROFILE_DIR = os.getenv('CIQ_PROFILE_DIR', 'profiles')
+PROFILE_KEEP = int(os.getenv('CIQ_PROFILE_KEEP', '200'))
+
+ENABLED = PROFILE_SAMPLE_RATE > 0 or PROFILE_SLOW_MS > 0
+
+_local = threading.local()
+_active = {}  # thread id -> RequestProfile being served on that thread
+_wakeup = threading.Event()
+_pending = queue.SimpleQueue()
+_ids = itertools.count(1)
+_started = False
+_start_lock = threading.Lock()
+
+
+class RequestProfile:
+    """Stack samples and phase timings collected for one request."""
+
+    __slots__ = ('id', 'name', 'started', 'sampled', 'spans', 'stacks', '_lock')
+
+    def __init__(self, name, sampled):
+        self.id = next(_ids)
+        self.name = name
+        self.started = time.time()
+        self.sampled = sampled
+        self.spans = {}  # phase name -> [(start, end)] in perf_counter seconds
+        self.stacks = Counter()
+        self._lock = threading.Lock()
+
+    def add_span(self, name, start, end):
+        # Pool threads attached to this request record phases concurrently
+        with self._lock:
+            self.spans.setdefault(name, []).append((start, end))
+
+    def phases(self):
+        """Return ``{phase: ms}``, counting overlapping spans of a phase once."""
+        with self._lock:
+            spans = {name: sorted(spans) for name, spans in self.spans.items()}
+        phases = {}
+        for name, spans in spans.items():
+            total = 0.0
+            covered_until = float('-inf')
+            for start, end in spans:
+                start = max(start, covered_until)
+                if end > start:
+                    total += end - start
+                    covered_until = end
+            phases[name] = total * 1000
+        return phases
+
+
+class _Phase:
+    __slots__ = ('name', 'profile', 'start')
+
+    def __init__(self, name, profile):
+        self.name = name
+        self.profile = profile
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profile.add_span(self.name, self.start, time.perf_counter())
+        return False
+
+
+class _NullPhase:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_PHASE = _NullPhase()
+
+
+def current():
+    """Return the profile of the request served by this thread, if any."""
+    return getattr(_local, 'profile', None)
+
+
+def phase(name):
+    """Context manager timing one phase of the current request."""
+    profile = getattr(_local, 'profile', None)
+    if profile is None:
+        return _NULL_PHASE
+    return _Phase(name, profile)
+
+
+def attach(profile):
+    """Attribute work on this thread to ``profile`` (e.g. from a worker pool).
+
+    Returns a callable that detaches the thread again.
+    """
+    if profile is None:
+        return _detach_noop
+    tid = threading.get_ident()
+    _local.profile = profile
+    _active[tid] = profile
+    _wakeup.set()
+
+    def detach():
+        _active.pop(tid, None)
+        _local.profile = None
+    return detach
+
+
+def _detach_noop():
+    pass
+
+
+def _collapse(frame):
+    """Render a frame chain as a root-to-leaf ``file:function`` stack string."""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    names.reverse()
+    return ';'.join(names)
+
+
+def _sampler():
+    interval = PROFILE_INTERVAL_MS / 1000
+    while True:
+        if not _active:
+            _wakeup.wait()
+            _wakeup.clear()
+            continue
+        frames = sys._current_frames()
+        for tid, profile in list(_active.items()):
+            frame = frames.get(tid)
+            if frame is not None:
+                profile.stacks[_collapse(frame)] += 1
+        del frames
+        time.sleep(interval)
+
+
+def _writer():
+    while True:
+        record = _pending.get()
+        try:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            # Ids are per process, so the pid keeps workers from overwriting each other
+            filename = f"{int(record['started'] * 1000)}-{record['pid']}-{record['id']}.json"
+            with open(os.path.join(PROFILE_DIR, filename), 'w') as f:
+                json.dump(record, f)
+            _rotate()
+        except OSError as e:
+            logger.warning("Profiler could not write profile: %s", e)
+
+
+def _rotate():
+    if PROFILE_KEEP <= 0:
+        return
+    names = sorted(n for n in os.listdir(PROFILE_DIR) if n.endswith('.json'))
+    for name in names[:-PROFILE_KEEP]:
+        try:
+            os.remove(os.path.join(PROFILE_DIR, name))
+        except OSError:
+            pass
+
+
+def _start_threads():
+    global _started
+    with _start_lock:
+        if not _started:
+            threading.Thread(target=_sampler, name='ciq-profiler', daemon=True).start()
+            threading.Thread(target=_writer, name='ciq-profile-writer', daemon=True).start()
+            _started = True
+
+
+def _finish(profile, total_ms):
+    slow = PROFILE_SLOW_MS > 0 and total_ms >= PROFILE_SLOW_MS
+    if not (slow or profile.sampled):
+        return
+    _pending.put({
+        'id': profile.id,
+        'pid': os.getpid(),
+        'name': profile.name,
+        'started': profile.started,
+        'reason': 'slow' if slow else 'sampled',
+        'total_ms': round(total_ms, 3),
+        'phases': {name: round(ms, 3) for name, ms in profile.phases().items()},
+        'interval_ms': PROFILE_INTERVAL_MS,
+        'stacks': dict(profile.stacks),
+    })
+
+
+def profile_request(func):
+    """Decorator profiling each call of ``func`` as one request."""
+    if not ENABLED:
+        return func
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not _started:
+            _start_threads()
+        profile = RequestProfile(func.__name__, random.random() < PROFILE_SAMPLE_RATE)
+        detach = attach(profile)
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            total_ms = (time.perf_counter() - start) * 1000
+            detach()
+            _finish(profile, total_ms)
+    return wrapper
+
+
+def top(directory=PROFILE_DIR, limit=20, reason=None):
+    """Aggregate saved profiles into the hottest functions and phase averages."""
+    self_counts = Counter()
+    total_counts = Counter()
+    phases = Counter()
+    profiles = 0
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith('.json'):
+            continue
+        with open(os.path.join(directory, name)) as f:
+            record = json.load(f)
+        if reason and record['reason'] != reason:
+            continue
+        profiles += 1
+        phases.update(record['phases'])
+        phases['total'] += record['total_ms']
+        for stack, count in record['stacks'].items():
+            funcs = stack.split(';')
+            self_counts[funcs[-1]] += count
+            for func in set(funcs):
+                total_counts[func] += count
+
+    print(f"{profiles} profiles in {directory}")
+    if not profiles:
+        return
+    print("\nAverage phase time (ms):")
+    for name, ms in phases.most_common():
+        print(f"  {ms / profiles:10.2f}  {name}")
+    samples = sum(self_counts.values()) or 1
+    print(f"\nTop {limit} functions by self samples ({samples} samples):")
+    print(f"  {'self%':>6} {'total%':>7}  function")
+    for func, count in self_counts.most_common(limit):
+        print(f"  {100 * count / samples:6.1f} {100 * total_counts[func] / samples:7.1f}  {func}")
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Aggregate saved request profiles.')
+    parser.add_argument('command', choices=['top'])
+    parser.add_argument('-n', '--limit', type=int, default=20)
+    parser.add_argument('-d', '--dir', default=PROFILE_DIR)
+    parser.add_argument('--reason', choices=['slow', 'sampled'])
+    args = parser.parse_args()
+    top(args.dir, args.limit, args.reason)
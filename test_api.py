@@ -0,0 +1,111 @@
+"""Tests for the read-only JSON API."""
+import gzip
+import json
+
+import pytest
+from flask import Flask
+
+import api as api_module
+import ciq_store
+from api import api
+
+
+@pytest.fixture
+def client():
+    app = Flask(__name__)
+    app.register_blueprint(api)
+    return app.test_client()
+
+
+def test_index_lists_every_station(client):
+    response = client.get('/api/stations', headers={'Accept-Encoding': 'identity'})
+
+    assert response.status_code == 200
+    assert response.mimetype == 'application/json'
+    assert response.content_encoding is None
+    body = response.get_json()
+    assert body['version'] == ciq_store.current().version
+    assert [station['code'] for station in body['stations']] == list(ciq_store.current())
+
+
+def test_station_record(client):
+    response = client.get('/api/stations/kul')
+
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['code'] == 'KUL'
+    assert body['airport_name'] == ciq_store.current()['KUL']['airport_name']
+
+
+def test_unknown_station_is_404(client):
+    response = client.get('/api/stations/XXX')
+
+    assert response.status_code == 404
+    assert response.get_json() == {'error': 'Unknown airport code XXX'}
+
+
+def test_gzip_is_negotiated(client):
+    plain = client.get('/api/stations/KUL', headers={'Accept-Encoding': 'identity'})
+    gzipped = client.get('/api/stations/KUL', headers={'Accept-Encoding': 'gzip'})
+
+    assert gzipped.content_encoding == 'gzip'
+    assert gzip.decompress(gzipped.data) == plain.data
+    assert gzipped.headers['Vary'] == 'Accept-Encoding'
+    assert gzipped.headers['ETag'] == plain.headers['ETag'][:-1] + '-gz"'
+
+
+@pytest.mark.parametrize('encoding', ['identity', 'gzip'])
+def test_if_none_match_answers_304(client, encoding):
+    first = client.get('/api/stations', headers={'Accept-Encoding': encoding})
+    etag = first.headers['ETag']
+
+    again = client.get('/api/stations', headers={'Accept-Encoding': encoding, 'If-None-Match': etag})
+    assert again.status_code == 304
+    assert again.data == b''
+    assert again.headers['ETag'] == etag
+
+    # The other encoding's tag does not match this variant
+    other = 'gzip' if encoding == 'identity' else 'identity'
+    changed = client.get('/api/stations', headers={'Accept-Encoding': other, 'If-None-Match': etag})
+    assert changed.status_code == 200
+
+
+def test_ndjson_export_streams_every_record(client):
+    response = client.get('/api/stations.ndjson', headers={'Accept-Encoding': 'identity'})
+
+    assert response.mimetype == 'application/x-ndjson'
+    lines = [json.loads(line) for line in response.data.decode('utf-8').splitlines()]
+    assert [line['code'] for line in lines] == list(ciq_store.current())
+    assert int(response.headers['Content-Length']) == len(response.data)
+
+
+def test_etag_changes_with_the_dataset(client):
+    original = ciq_store.current()
+    before = client.get('/api/stations/KUL').headers['ETag']
+    stations = original.to_dict()
+    stations['KUL']['GD'] = 'changed'
+    ciq_store.swap(ciq_store.build_table(stations))
+    try:
+        response = client.get('/api/stations/KUL', headers={'If-None-Match': before})
+        assert response.status_code == 200
+        assert response.headers['ETag'] != before
+    finally:
+        ciq_store.swap(original)
+
+
+def test_busy_api_answers_503(client):
+    acquired = 0
+    while api_module._slots.acquire(blocking=False):
+        acquired += 1
+    try:
+        response = client.get('/api/stations')
+        assert response.status_code == 503
+        assert response.headers['Retry-After'] == '1'
+    finally:
+        for _ in range(acquired):
+            api_module._slots.release()
+
+    # Slots are released after every request, including the rejected one
+    assert client.get('/api/stations').status_code == 200
+    assert api_module._slots.acquire(blocking=False)
+    api_module._slots.release()
@@ -0,0 +1,62 @@
+"""Tests for rendering station cards ahead of quick-reply taps."""
+from collections import deque
+import time
+
+import pytest
+
+pytest.importorskip('PIL')
+
+import cards  # noqa: E402
+import ciq_store  # noqa: E402
+
+
+@pytest.fixture
+def card_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(cards, 'CARD_DIR', str(tmp_path))
+    monkeypatch.setattr(cards, '_ready', {})
+    monkeypatch.setattr(cards, '_failed', set())
+    monkeypatch.setattr(cards, '_priority', deque(maxlen=64))
+    return tmp_path
+
+
+def wait_for(condition):
+    for _ in range(200):
+        if condition():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def test_warm_renders_missing_cards_when_no_build_runs(card_dir):
+    cards.warm(['KUL', 'XXX'])
+
+    assert wait_for(lambda: 'KUL' in cards._ready)
+    digest = cards._ready['KUL']
+    assert digest == cards.card_digest('KUL', ciq_store.current()['KUL'])
+    assert (card_dir / f'{digest}.png').read_bytes().startswith(b'\x89PNG')
+    assert 'XXX' not in cards._ready
+
+
+def test_warm_does_not_retry_failed_cards(card_dir, monkeypatch):
+    calls = []
+
+    def broken(code, info):
+        calls.append(code)
+        raise OSError('no font')
+
+    monkeypatch.setattr(cards, 'render_card', broken)
+    cards.warm(['KUL'])
+    assert wait_for(lambda: cards._failed and not cards._build_lock.locked())
+
+    cards.warm(['KUL'])
+    time.sleep(0.1)
+    assert calls == ['KUL']
+    assert 'KUL' not in cards._ready
+
+
+def test_warm_is_a_no_op_for_ready_cards(card_dir, monkeypatch):
+    cards._ready['KUL'] = 'ready'
+    monkeypatch.setattr(cards, '_build_codes', lambda *args: pytest.fail('rendered a ready card'))
+
+    cards.warm(['KUL'])
+    assert 'KUL' not in cards._priority
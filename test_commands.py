@@ -0,0 +1,133 @@
+"""Tests for the slash-command router and its middleware."""
+from types import SimpleNamespace
+
+from linebot.models import TextSendMessage
+
+from commands import CommandContext, CommandRouter, handle_errors, rate_limit
+
+
+def event(user_id='U1', group_id=None):
+    return SimpleNamespace(source=SimpleNamespace(user_id=user_id, group_id=group_id, room_id=None))
+
+
+def make_router():
+    router = CommandRouter()
+    calls = []
+
+    @router.command('changes')
+    def changes(ctx):
+        calls.append(('CHANGES', ctx.args))
+        return 'changes'
+
+    @router.default()
+    def station(ctx):
+        calls.append((ctx.command, ctx.args))
+        return 'station'
+
+    return router, calls
+
+
+def test_dispatches_registered_command_case_insensitively():
+    router, calls = make_router()
+
+    assert router.dispatch('/changes 12') == 'changes'
+    assert calls == [('CHANGES', '12')]
+
+
+def test_unknown_command_falls_back_to_default():
+    router, calls = make_router()
+
+    assert router.dispatch('  /kul   @2026-09-01 ') == 'station'
+    assert calls == [('KUL', '@2026-09-01')]
+
+
+def test_non_command_text_returns_none_without_calling_handlers():
+    router, calls = make_router()
+
+    assert router.dispatch('hello crew') is None
+    assert router.dispatch('') is None
+    assert calls == []
+
+
+def test_without_default_unknown_commands_return_none():
+    router = CommandRouter()
+
+    assert router.dispatch('/KUL') is None
+
+
+def test_first_hook_is_outermost():
+    order = []
+
+    def hook(name):
+        def call(ctx, call_next):
+            order.append(f'{name} in')
+            result = call_next(ctx)
+            order.append(f'{name} out')
+            return result
+        return call
+
+    router = CommandRouter()
+    router.use(hook('global'))
+
+    @router.command('PAIRING', hook('first'), hook('second'))
+    def pairing(ctx):
+        order.append('handler')
+
+    router.dispatch('/PAIRING DMK-KUL')
+    assert order == ['global in', 'first in', 'second in', 'handler', 'second out', 'first out', 'global out']
+
+
+def test_use_after_registration_recomposes_handlers():
+    router, calls = make_router()
+    seen = []
+
+    def hook(ctx, call_next):
+        seen.append(ctx.command)
+        return call_next(ctx)
+
+    router.use(hook)
+    router.dispatch('/CHANGES 1')
+    router.dispatch('/KUL')
+    assert seen == ['CHANGES', 'KUL']
+
+
+def test_hooks_can_short_circuit():
+    router, calls = make_router()
+    router.use(lambda ctx, call_next: None)
+
+    assert router.dispatch('/KUL') is None
+    assert calls == []
+
+
+def test_handle_errors_apologises():
+    router = CommandRouter()
+    router.use(handle_errors)
+
+    @router.default()
+    def broken(ctx):
+        raise RuntimeError('boom')
+
+    messages = router.dispatch('/KUL')
+    assert len(messages) == 1
+    assert isinstance(messages[0], TextSendMessage)
+    assert messages[0].text.startswith('Sorry, something went wrong')
+
+
+def test_rate_limit_drops_users_over_the_limit():
+    router, calls = make_router()
+    router.use(rate_limit(per_minute=2))
+
+    results = [router.dispatch('/KUL', event('U1')) for _ in range(3)]
+    assert results == ['station', 'station', None]
+    # Other users have their own bucket, and events without a user pass
+    assert router.dispatch('/KUL', event('U2')) == 'station'
+    assert router.dispatch('/KUL') == 'station'
+    assert len(calls) == 4
+
+
+def test_context_ids():
+    assert CommandContext('KUL', '', event('U1')).chat_id == 'U1'
+    group = CommandContext('KUL', '', event('U1', group_id='G1'))
+    assert group.user_id == 'U1'
+    assert group.chat_id == 'G1'
+    assert CommandContext('KUL', '').user_id is None
@@ -0,0 +1,140 @@
+"""Tests for concurrent dispatch of webhook batches."""
+import base64
+import contextvars
+import hashlib
+import hmac
+import json
+import threading
+import time
+
+import pytest
+from linebot.exceptions import InvalidSignatureError
+from linebot.models import MessageEvent, TextMessage
+
+from dispatch import ConcurrentWebhookHandler
+
+# The bot uses the SDK's legacy models, which warn on every parsed event
+pytestmark = pytest.mark.filterwarnings('ignore::linebot.deprecations.LineBotSdkDeprecationWarning')
+
+SECRET = 'test-secret'
+
+
+def webhook(texts):
+    events = [{
+        'type': 'message',
+        'mode': 'active',
+        'timestamp': 0,
+        'webhookEventId': f'event-{n}',
+        'deliveryContext': {'isRedelivery': False},
+        'replyToken': f'token-{n}',
+        'source': {'type': 'user', 'userId': f'U{n}'},
+        'message': {'type': 'text', 'id': str(n), 'text': text},
+    } for n, text in enumerate(texts)]
+    body = json.dumps({'destination': 'Utest', 'events': events})
+    signature = base64.b64encode(hmac.new(SECRET.encode(), body.encode(), hashlib.sha256).digest()).decode()
+    return body, signature
+
+
+class StubLineApi:
+    """Stands in for ``LineBotApi.reply_message``: 'slow' sleeps, 'boom' raises."""
+
+    def __init__(self):
+        self.replies = []
+        self.threads = []
+        self.lock = threading.Lock()
+
+    def reply_message(self, reply_token, text):
+        with self.lock:
+            self.threads.append(threading.current_thread().name)
+        if text == 'slow':
+            time.sleep(0.5)
+        if text == 'boom':
+            raise RuntimeError('LINE API error')
+        with self.lock:
+            self.replies.append(reply_token)
+
+
+@pytest.fixture
+def api():
+    return StubLineApi()
+
+
+@pytest.fixture
+def handler(api):
+    handler = ConcurrentWebhookHandler(SECRET, max_workers=4, deadline=0.2)
+
+    @handler.add(MessageEvent, message=TextMessage)
+    def handle_message(event):
+        api.reply_message(event.reply_token, event.message.text)
+
+    yield handler
+    handler._executor.shutdown(wait=True)
+
+
+def wait_for_idle(handler):
+    for _ in range(100):
+        if not handler.pending:
+            return
+        time.sleep(0.01)
+
+
+def test_single_event_runs_inline(handler, api):
+    handler.handle(*webhook(['/KUL']))
+
+    assert api.replies == ['token-0']
+    assert api.threads == [threading.current_thread().name]
+    assert handler.pending == 0
+
+
+def test_batch_runs_on_the_pool(handler, api):
+    handler.handle(*webhook(['/KUL', '/SIN', '/HKG']))
+    wait_for_idle(handler)
+
+    assert sorted(api.replies) == ['token-0', 'token-1', 'token-2']
+    assert all(name.startswith('ciq-dispatch') for name in api.threads)
+    assert handler.pending == 0
+
+
+def test_one_failing_event_does_not_affect_the_others(handler, api):
+    handler.handle(*webhook(['/KUL', 'boom', '/SIN']))
+    wait_for_idle(handler)
+
+    assert sorted(api.replies) == ['token-0', 'token-2']
+    assert handler.pending == 0
+
+
+def test_handle_returns_by_the_deadline(handler, api):
+    start = time.perf_counter()
+    handler.handle(*webhook(['slow', '/KUL']))
+    elapsed = time.perf_counter() - start
+
+    assert elapsed < 0.4
+    assert api.replies == ['token-1']
+    assert handler.pending == 1
+
+    wait_for_idle(handler)
+    assert sorted(api.replies) == ['token-0', 'token-1']
+    assert handler.pending == 0
+
+
+def test_signature_is_enforced(handler, api):
+    body, _ = webhook(['/KUL', '/SIN'])
+
+    with pytest.raises(InvalidSignatureError):
+        handler.handle(body, 'bad-signature')
+    assert api.replies == []
+
+
+def test_pool_threads_see_the_request_context(api):
+    level = contextvars.ContextVar('level', default='normal')
+    handler = ConcurrentWebhookHandler(SECRET, max_workers=2, deadline=1.0)
+    seen = []
+
+    @handler.add(MessageEvent, message=TextMessage)
+    def handle_message(event):
+        seen.append(level.get())
+
+    level.set('degraded')
+    handler.handle(*webhook(['/KUL', '/SIN']))
+    handler._executor.shutdown(wait=True)
+    assert seen == ['degraded', 'degraded']
@@ -0,0 +1,50 @@
+"""Tests for the per-version cache of station replies."""
+import pytest
+
+import ciq_format
+import ciq_store
+from ciq_format import format_ciq_info, station_reply, warm_replies
+
+
+@pytest.fixture
+def tables():
+    original = ciq_store.current()
+    stations = original.to_dict()
+    stations['KUL']['GD'] = 'new GD'
+    updated = ciq_store.build_table(stations)
+    yield original, updated
+    ciq_store.swap(original)
+
+
+def test_warmed_replies_are_served_from_cache_only(tables):
+    original, _ = tables
+    warm_replies()
+
+    assert station_reply('KUL', cached_only=True) == format_ciq_info('KUL', original)
+    assert station_reply('XXX', cached_only=True) is None
+    assert station_reply('XXX').startswith("Sorry, I don't have information")
+
+
+def test_swap_installs_the_new_replies(tables):
+    _, updated = tables
+    ciq_store.swap(updated)
+
+    assert 'GD - new GD' in station_reply('KUL', cached_only=True)
+
+
+def test_late_caller_cannot_replace_the_new_cache(tables):
+    original, updated = tables
+    ciq_store.swap(updated)
+
+    # A warm-up of the old table that finishes after the swap is discarded
+    warm_replies(original)
+    assert ciq_format._replies[0] == updated.version
+    assert 'GD - new GD' in station_reply('KUL', cached_only=True)
+
+
+def test_unwarmed_version_renders_without_caching(tables, monkeypatch):
+    monkeypatch.setattr(ciq_format, '_replies', (None, {}))
+
+    assert station_reply('KUL', cached_only=True) is None
+    assert station_reply('KUL') == format_ciq_info('KUL')
+    assert ciq_format._replies == (None, {})
@@ -0,0 +1,158 @@
+"""Tests for the field-level change history in ciq_history."""
+from datetime import datetime, timedelta, timezone
+import json
+import threading
+
+import pytest
+
+from ciq_data import ciq_data
+from ciq_format import MAX_REPLY_CHARS, reply_length
+from ciq_history import HistoryStore, format_changes, format_station_history, parse_when
+
+KUL = {'airport_name': 'Kuala Lumpur', 'GD': '2 copies', 'remark': ''}
+SIN = {'airport_name': 'Changi', 'GD': '3 copies', 'remark': 'Gate C'}
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'history.jsonl')
+
+
+def test_records_only_changes(path):
+    history = HistoryStore(path)
+
+    assert history.record({'KUL': KUL, 'SIN': SIN}) == 1
+    assert history.record({'KUL': KUL, 'SIN': SIN}) is None
+    assert history.record({'KUL': dict(KUL, GD='4 copies'), 'SIN': SIN}) == 2
+    assert [change[2:] for change in history.changes_since(1)] == [('KUL', 'GD', '2 copies', '4 copies')]
+
+
+def test_removed_station_survives_in_older_versions(path):
+    history = HistoryStore(path)
+    history.record({'KUL': KUL, 'SIN': SIN})
+    history.record({'KUL': KUL})
+
+    assert history.station_at('SIN', 1) == SIN
+    assert history.station_at('SIN', 2) is None
+    removed = {(code, field, new) for _, _, code, field, _, new in history.changes_since(1)}
+    assert removed == {('SIN', field, None) for field in SIN}
+
+    history.record({'KUL': KUL, 'SIN': SIN})
+    assert history.station_at('SIN', 3) == SIN
+
+
+def test_removed_and_re_added_field(path):
+    history = HistoryStore(path)
+    history.record({'KUL': KUL})
+    history.record({'KUL': {'airport_name': 'Kuala Lumpur', 'remark': ''}})
+    history.record({'KUL': dict(KUL, GD='5 copies')})
+
+    assert history.station_at('KUL', 1)['GD'] == '2 copies'
+    assert 'GD' not in history.station_at('KUL', 2)
+    assert history.station_at('KUL', 3)['GD'] == '5 copies'
+    assert history.station_at('KUL', 0) is None
+    changes = [(version, old, new) for version, _, _, field, old, new in history.changes_since(0) if field == 'GD']
+    assert changes == [(1, None, '2 copies'), (2, '2 copies', None), (3, None, '5 copies')]
+
+
+def test_point_in_time_lookup(path):
+    start = datetime(2026, 9, 1, tzinfo=timezone.utc)
+    with open(path, 'w') as f:
+        for version, gd in enumerate(['1 copy', '2 copies', '3 copies'], 1):
+            entry = {
+                'v': version,
+                'ts': (start + timedelta(days=version)).isoformat(),
+                'dataset': None,
+                'changes': [['KUL', 'GD', gd]],
+            }
+            f.write(json.dumps(entry) + '\n')
+    history = HistoryStore(path)
+
+    assert history.version_at(start) == 0
+    assert history.version_at(start + timedelta(days=1)) == 1
+    assert history.version_at(start + timedelta(days=2, hours=12)) == 2
+    assert history.version_at(parse_when('2026-09-03')) == 2
+    assert history.version_at(start + timedelta(days=30)) == 3
+    assert history.station_at('KUL', history.version_at(parse_when('2026-09-02')))['GD'] == '1 copy'
+
+
+def test_partial_line_is_read_once_complete(path):
+    history = HistoryStore(path)
+    history.record({'KUL': KUL})
+    entry = json.dumps({'v': 2, 'ts': '2026-09-02T00:00:00+00:00', 'dataset': None,
+                        'changes': [['KUL', 'GD', '9 copies']]})
+    with open(path, 'a') as f:
+        f.write(entry[:20])
+    history.refresh()
+    assert history.head == 1
+
+    with open(path, 'a') as f:
+        f.write(entry[20:] + '\n')
+    history.refresh()
+    assert history.station_at('KUL', 2)['GD'] == '9 copies'
+
+
+def test_workers_share_one_history_file(path):
+    first = HistoryStore(path)
+    second = HistoryStore(path)
+    first.record({'KUL': KUL})
+
+    # The second worker sees the version first recorded instead of duplicating it
+    assert second.record({'KUL': KUL}) is None
+    assert second.head == 1
+    assert second.record({'KUL': dict(KUL, GD='6 copies')}) == 2
+    first.refresh()
+    assert first.station_at('KUL', 2)['GD'] == '6 copies'
+
+
+def test_queries_while_recording(path):
+    history = HistoryStore(path)
+    history.record({'KUL': KUL})
+    errors = []
+    done = threading.Event()
+
+    def query():
+        try:
+            while not done.is_set():
+                version = history.version_at(datetime.now(timezone.utc))
+                history.station_at('KUL', version)
+                list(history.changes_since(max(version - 2, 0)))
+        except Exception as e:
+            errors.append(e)
+
+    readers = [threading.Thread(target=query) for _ in range(4)]
+    for reader in readers:
+        reader.start()
+    for n in range(200):
+        history.record({'KUL': dict(KUL, GD=f'{n} copies'), f'X{n}': SIN})
+    done.set()
+    for reader in readers:
+        reader.join()
+
+    assert not errors
+    assert history.head == 201
+
+
+def test_changes_fit_one_message_in_utf16_units(path):
+    history = HistoryStore(path)
+    history.record({'KUL': KUL})
+    for n in range(200):
+        # Astral emoji count as two UTF-16 units each
+        history.record({'KUL': dict(KUL, GD=f'{n} copies 🛂🛂🛂🛂🛂🛂🛂🛂🛂🛂')})
+
+    response = format_changes(history, '1')
+    assert reply_length(response) <= MAX_REPLY_CHARS
+    assert response.endswith('… more changes not shown')
+
+
+def test_formatting(path):
+    kul = ciq_data['KUL']
+    history = HistoryStore(path)
+    history.record({'KUL': dict(kul, GD='2 copies')})
+    history.record({'KUL': dict(kul, GD='4 copies')})
+
+    assert '2 copies → 4 copies' in format_changes(history, '1')
+    assert format_changes(history, '2') == 'No changes since version 2 (latest is 2).'
+    assert "can't read the version" in format_changes(history, 'x')
+    assert "don't have information" in format_station_history(history, 'KUL', '2000-01-01')
+    assert 'version 2' in format_station_history(history, 'KUL', '2099-01-01')
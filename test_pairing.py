@@ -0,0 +1,57 @@
+"""Tests for the /PAIRING brief."""
+import ciq_store
+from ciq_format import MAX_REPLY_CHARS, reply_length
+from pairing import format_pairing
+
+
+def test_shared_lines_are_folded():
+    brief = format_pairing('DMK-KUL-DMK-SIN-DMK')
+
+    assert brief.startswith('✈️ *PAIRING DMK-KUL-DMK-SIN-DMK* ✈️\nSectors: DMK→KUL, KUL→DMK, DMK→SIN, SIN→DMK\n')
+    assert '🔁 *ALL STATIONS (KUL, SIN):*' in brief
+    assert brief.count('• Immigration - N') == 1
+    assert brief.endswith('No CIQ information for: DMK')
+
+
+def test_fragments_of_a_replaced_table_are_not_cached():
+    original = ciq_store.current()
+    stations = original.to_dict()
+    stations['KUL']['GD'] = 'new GD'
+    updated = ciq_store.build_table(stations)
+    ciq_store.swap(updated)
+    try:
+        # A request still holding the old table finishes after the swap
+        assert 'GD - new GD' not in format_pairing('DMK-KUL', original)
+        assert 'GD - new GD' in format_pairing('DMK-KUL')
+        format_pairing('DMK-KUL', original)
+        assert 'GD - new GD' in format_pairing('DMK-KUL')
+    finally:
+        ciq_store.swap(original)
+    assert 'GD - new GD' not in format_pairing('DMK-KUL')
+
+
+def test_reply_length_counts_utf16_units():
+    assert reply_length('KUL') == 3
+    assert reply_length('✈️') == 2
+    assert reply_length('📍') == 2
+
+
+def test_long_routes_fit_one_message():
+    codes = list(ciq_store.current())
+    routes = [
+        '-'.join(['DMK', 'KUL'] * 200),
+        'DMK-' + '-'.join(codes),
+        'DMK-' + '-'.join(codes + [f'Q{i:02d}' for i in range(300)]),
+    ]
+    for route in routes:
+        brief = format_pairing(route)
+        assert reply_length(brief) <= MAX_REPLY_CHARS
+        assert '… (' in brief.split('\n', 1)[0]
+
+
+def test_unknown_codes_are_listed_after_a_cut_brief():
+    codes = list(ciq_store.current())
+    brief = format_pairing('DMK-' + '-'.join(codes + [f'Q{i:02d}' for i in range(300)]))
+
+    assert 'brief too long; use /' in brief
+    assert brief.endswith('No CIQ information for: Q00, Q01, Q02, Q03, Q04, Q05, Q06, Q07, Q08, Q09, … (290 more)')
@@ -0,0 +1,92 @@
+"""Tests for the request profiler's phase timings, rotation and summary."""
+import json
+
+import pytest
+
+import profiling
+from profiling import RequestProfile
+
+
+def test_overlapping_and_nested_spans_count_once():
+    profile = RequestProfile('callback', sampled=True)
+    # Two pool threads replying at once, a third nested inside the first
+    profile.add_span('reply', 1.000, 1.100)
+    profile.add_span('reply', 1.050, 1.150)
+    profile.add_span('reply', 1.010, 1.020)
+    # A later, separate reply
+    profile.add_span('reply', 1.200, 1.250)
+    profile.add_span('format', 0.900, 0.910)
+
+    phases = profile.phases()
+    assert phases['reply'] == pytest.approx(200.0)
+    assert phases['format'] == pytest.approx(10.0)
+
+
+def test_spans_are_counted_out_of_order():
+    profile = RequestProfile('callback', sampled=True)
+    profile.add_span('reply', 2.0, 3.0)
+    profile.add_span('reply', 0.0, 2.5)
+
+    assert profile.phases()['reply'] == pytest.approx(3000.0)
+
+
+def test_phase_is_a_no_op_outside_a_profiled_request():
+    assert profiling.current() is None
+    with profiling.phase('reply'):
+        pass
+
+
+def test_phase_records_on_attached_threads():
+    profile = RequestProfile('callback', sampled=True)
+    detach = profiling.attach(profile)
+    try:
+        with profiling.phase('handle'):
+            pass
+    finally:
+        detach()
+
+    assert list(profile.phases()) == ['handle']
+    assert profiling.current() is None
+
+
+def write_profile(directory, started, reason, phases, stacks):
+    record = {
+        'id': 1, 'pid': 7, 'name': 'callback', 'started': started, 'reason': reason,
+        'total_ms': phases['total'], 'phases': {k: v for k, v in phases.items() if k != 'total'},
+        'interval_ms': 5, 'stacks': stacks,
+    }
+    with open(directory / f"{int(started * 1000)}-7-1.json", 'w') as f:
+        json.dump(record, f)
+
+
+def test_rotation_keeps_the_newest_profiles(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling, 'PROFILE_DIR', str(tmp_path))
+    monkeypatch.setattr(profiling, 'PROFILE_KEEP', 3)
+    for started in range(1, 6):
+        write_profile(tmp_path, started, 'sampled', {'total': 1.0}, {})
+    (tmp_path / 'notes.txt').write_text('kept')
+
+    profiling._rotate()
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        '3000-7-1.json', '4000-7-1.json', '5000-7-1.json', 'notes.txt',
+    ]
+
+
+def test_top_aggregates_phases_and_functions(tmp_path, capsys):
+    write_profile(tmp_path, 1, 'slow', {'total': 40.0, 'reply': 30.0},
+                  {'a.py:main;b.py:reply': 3, 'a.py:main': 1})
+    write_profile(tmp_path, 2, 'sampled', {'total': 20.0, 'reply': 10.0},
+                  {'a.py:main;b.py:reply': 1})
+
+    profiling.top(str(tmp_path), limit=5)
+    out = capsys.readouterr().out
+    assert out.startswith(f"2 profiles in {tmp_path}")
+    assert '30.00  total' in out
+    assert '20.00  reply' in out
+    assert '  80.0    80.0  b.py:reply' in out
+    assert '  20.0   100.0  a.py:main' in out
+
+    profiling.top(str(tmp_path), reason='slow')
+    out = capsys.readouterr().out
+    assert out.startswith(f"1 profiles in {tmp_path}")
+    assert '40.00  total' in out
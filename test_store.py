@@ -0,0 +1,150 @@
+"""Tests for the packed station snapshot in ciq_store."""
+import os
+import struct
+import sys
+
+import pytest
+
+import ciq_store
+from ciq_store import (
+    LIST_FLAG, MISSING, StationTable, build_table, dataset_version, load_snapshot,
+    load_stations, pack_stations, write_snapshot,
+)
+
+STATIONS = {
+    'KUL': {
+        'airport_name': 'Kuala Lumpur International Airport',
+        'special_announcement': ['Drug trafficking', 'Beware of belongings'],
+        'GD': '2 copies',
+        'remark': '',
+    },
+    'NRT': {
+        'airport_name': '成田国際空港 ✈️',
+        'special_announcement': [],
+        'remark': '',
+    },
+    'SIN': {
+        'airport_name': 'Changi',
+        'special_announcement': 'N',
+        'GD': '2 copies',
+    },
+}
+
+
+def test_round_trip_preserves_every_record():
+    table = build_table(STATIONS)
+
+    assert table.to_dict() == STATIONS
+    assert list(table) == ['KUL', 'NRT', 'SIN']
+    assert table.version == dataset_version(STATIONS)
+    assert table.source == ''
+    assert build_table(STATIONS, source='sync:7').source == 'sync:7'
+
+
+def test_lists_strings_and_missing_fields_decode():
+    table = build_table(STATIONS)
+
+    assert table['KUL']['special_announcement'] == ['Drug trafficking', 'Beware of belongings']
+    assert table['NRT']['special_announcement'] == []
+    assert table['SIN']['special_announcement'] == 'N'
+    assert table['NRT']['airport_name'] == '成田国際空港 ✈️'
+    assert 'GD' not in table['NRT']
+    assert table['NRT'].get('GD', 'N/A') == 'N/A'
+    with pytest.raises(KeyError):
+        table['NRT']['GD']
+    with pytest.raises(KeyError):
+        table['KUL']['no_such_field']
+    assert 'BWA' not in table
+
+
+def test_rows_reference_a_deduplicated_string_table():
+    table = build_table(STATIONS)
+    cells = list(table._cells)
+    gd = table.fields.index('GD') + 1
+    stride = len(table.fields) + 1
+
+    # Both stations with '2 copies' point at one string; NRT has no GD at all
+    assert cells[gd] == cells[2 * stride + gd] != MISSING
+    assert cells[stride + gd] == MISSING
+    assert cells[table.fields.index('special_announcement') + 1] & LIST_FLAG
+
+
+def test_empty_dataset_round_trips():
+    assert build_table({}).to_dict() == {}
+
+
+def test_rejects_foreign_bytes():
+    with pytest.raises(ValueError):
+        StationTable(b'XXXX' + bytes(pack_stations(STATIONS))[4:])
+
+
+def test_snapshot_file_is_mapped(tmp_path):
+    path = str(tmp_path / 'snapshot.bin')
+    write_snapshot(STATIONS, path)
+
+    table = load_snapshot(path)
+    assert table.to_dict() == STATIONS
+    assert not os.path.exists(f"{path}.{os.getpid()}.tmp")
+
+
+def test_load_stations_writes_missing_snapshot_without_keeping_ciq_data(tmp_path):
+    path = str(tmp_path / 'snapshot.bin')
+    sys.modules.pop('ciq_data', None)
+
+    table = load_stations(path)
+    assert os.path.exists(path)
+    assert 'ciq_data' not in sys.modules
+    assert isinstance(table._buffer, ciq_store.mmap.mmap)
+    assert 'KUL' in table
+
+
+def test_load_stations_rebuilds_snapshot_older_than_ciq_data(tmp_path, caplog):
+    path = str(tmp_path / 'snapshot.bin')
+    write_snapshot(STATIONS, path)
+    os.utime(path, (0, 0))
+
+    table = load_stations(path)
+    assert table.version != dataset_version(STATIONS)
+    assert 'newer than snapshot' in caplog.text
+
+
+@pytest.mark.parametrize('content', [
+    b'',
+    b'CIQS',
+    b'JUNK' * 64,
+    struct.pack('<4sHHIIIII', ciq_store.MAGIC, 1, 0, 0, 0, 0, 0, 0),
+    bytes(pack_stations(STATIONS))[:-40],
+], ids=['empty', 'header-only', 'foreign', 'old-format', 'truncated'])
+def test_load_stations_rebuilds_unreadable_snapshot(tmp_path, caplog, content):
+    path = tmp_path / 'snapshot.bin'
+    path.write_bytes(content)
+
+    table = load_stations(str(path))
+    assert 'KUL' in table
+    assert load_snapshot(str(path)).version == table.version
+    assert 'unreadable' in caplog.text
+
+
+def test_synced_snapshot_survives_a_newer_ciq_data(tmp_path):
+    path = str(tmp_path / 'snapshot.bin')
+    write_snapshot(STATIONS, path, source='sync:42')
+    os.utime(path, (0, 0))
+
+    assert load_stations(path, keep_synced=True).source == 'sync:42'
+    # Without a sync source configured ciq_data.py wins again
+    assert load_stations(path, keep_synced=False).source == ''
+
+
+def test_load_stations_keeps_newer_snapshot(tmp_path):
+    path = str(tmp_path / 'snapshot.bin')
+    write_snapshot(STATIONS, path)
+
+    assert load_stations(path).to_dict() == STATIONS
+
+
+def test_load_stations_falls_back_to_memory(tmp_path):
+    path = str(tmp_path / 'missing-dir' / 'snapshot.bin')
+
+    table = load_stations(path)
+    assert 'KUL' in table
+    assert not isinstance(table._buffer, ciq_store.mmap.mmap)
@@ -0,0 +1,279 @@
+"""Tests for ciq_sync against a local stand-in of the dataset source."""
+import copy
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+import ciq_store
+from ciq_data import ciq_data
+from ciq_sync import DatasetSync, SyncError, checksum
+
+
+class Source:
+    """Versioned dataset served by the stand-in server."""
+
+    def __init__(self, supports_delta=True):
+        self.supports_delta = supports_delta
+        self.corrupt = False
+        self.versions = {}
+        self.latest = None
+        self.requests = []
+
+    def publish(self, stations):
+        version = str(len(self.versions) + 1)
+        self.versions[version] = copy.deepcopy(stations)
+        self.latest = version
+        return version
+
+    def document(self, since):
+        stations = self.versions[self.latest]
+        document = {'version': self.latest, 'sha256': checksum(stations)}
+        if self.supports_delta and since in self.versions:
+            base = self.versions[since]
+            document['base'] = since
+            document['changed'] = {code: info for code, info in stations.items() if base.get(code) != info}
+            document['removed'] = [code for code in base if code not in stations]
+        else:
+            document['stations'] = stations
+        if self.corrupt:
+            document['sha256'] = '0' * 64
+        return document
+
+
+@pytest.fixture
+def source():
+    source = Source()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            query = parse_qs(urlsplit(self.path).query)
+            since = query.get('since', [None])[0]
+            source.requests.append((since, self.headers.get('If-None-Match')))
+            etag = f'"{source.latest}"'
+            if self.headers.get('If-None-Match') == etag:
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.end_headers()
+                return
+            body = json.dumps(source.document(since)).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('ETag', etag)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    source.url = f"http://127.0.0.1:{server.server_port}/stations"
+    yield source
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(autouse=True)
+def restore_table():
+    original = ciq_store.current()
+    yield
+    ciq_store.swap(original)
+
+
+def changed_dataset():
+    stations = copy.deepcopy(ciq_data)
+    stations['KUL']['GD'] = '3 copies prepared by GS'
+    del stations['BWA']
+    return stations
+
+
+def test_full_fetch_swaps_in_new_data(source):
+    source.publish(changed_dataset())
+    sync = DatasetSync(source.url)
+
+    assert sync.sync_once() is True
+    assert ciq_store.current()['KUL']['GD'] == '3 copies prepared by GS'
+    assert 'BWA' not in ciq_store.current()
+    stats = sync.stats()
+    assert stats['full_updates'] == 1
+    assert stats['bytes_fetched'] == stats['last_fetch_bytes'] > 0
+    assert stats['source_version'] == '1'
+    assert stats['lag_s'] is not None
+
+
+def test_unchanged_source_answers_not_modified(source):
+    source.publish(ciq_data)
+    sync = DatasetSync(source.url)
+    sync.sync_once()
+    fetched = sync.stats()['bytes_fetched']
+
+    assert sync.sync_once() is False
+    assert source.requests[-1] == ('1', '"1"')
+    stats = sync.stats()
+    assert stats['not_modified'] == 1
+    assert stats['last_fetch_bytes'] == 0
+    assert stats['bytes_fetched'] == fetched
+
+
+def test_delta_pull_applies_only_changes(source):
+    source.publish(ciq_data)
+    sync = DatasetSync(source.url)
+    sync.sync_once()
+    full_bytes = sync.stats()['last_fetch_bytes']
+
+    source.publish(changed_dataset())
+    assert sync.sync_once() is True
+    stats = sync.stats()
+    assert stats['delta_updates'] == 1
+    assert stats['last_fetch_bytes'] < full_bytes / 10
+    assert ciq_store.current().to_dict() == changed_dataset()
+
+
+def test_source_without_deltas_falls_back_to_full(source):
+    source.supports_delta = False
+    source.publish(ciq_data)
+    sync = DatasetSync(source.url)
+    sync.sync_once()
+
+    source.publish(changed_dataset())
+    assert sync.sync_once() is True
+    assert sync.stats()['full_updates'] == 1
+    assert ciq_store.current().to_dict() == changed_dataset()
+
+
+def test_checksum_mismatch_keeps_current_data(source):
+    before = ciq_store.current()
+    source.publish(changed_dataset())
+    source.corrupt = True
+    sync = DatasetSync(source.url)
+
+    with pytest.raises(SyncError):
+        sync.sync_once()
+    assert ciq_store.current() is before
+
+
+def test_snapshot_is_written_and_mapped(source, tmp_path):
+    source.publish(changed_dataset())
+    path = tmp_path / 'ciq_snapshot.bin'
+    sync = DatasetSync(source.url, snapshot_path=str(path))
+
+    sync.sync_once()
+    assert path.exists()
+    assert ciq_store.load_snapshot(str(path)).to_dict() == changed_dataset()
+
+
+def test_failures_stay_off_the_request_path():
+    sync = DatasetSync('http://127.0.0.1:9/unreachable', interval=60, timeout=1)
+    sync.start()
+    for _ in range(50):
+        if sync.stats()['failures']:
+            break
+        time.sleep(0.1)
+    sync.stop()
+
+    stats = sync.stats()
+    assert stats['failures'] == 1
+    assert stats['last_error']
+
+
+def test_one_process_polls_and_the_others_map_its_snapshot(source, tmp_path):
+    original = ciq_store.current()
+    source.publish(changed_dataset())
+    path = str(tmp_path / 'ciq_snapshot.bin')
+    leader = DatasetSync(source.url, snapshot_path=path)
+    follower = DatasetSync(source.url, snapshot_path=path)
+
+    assert leader.check() is True
+    # As if the follower were another worker still serving the old table
+    ciq_store.swap(original)
+    assert follower.check() is True
+    assert len(source.requests) == 1
+    assert leader.stats()['leader'] and not follower.stats()['leader']
+    assert follower.stats()['reloads'] == 1
+    assert ciq_store.current().to_dict() == changed_dataset()
+    assert follower.check() is False
+    leader.stop()
+    follower.stop()
+
+
+def test_leadership_passes_on_when_the_leader_stops(source, tmp_path):
+    source.publish(ciq_data)
+    path = str(tmp_path / 'ciq_snapshot.bin')
+    leader = DatasetSync(source.url, snapshot_path=path)
+    follower = DatasetSync(source.url, snapshot_path=path)
+    leader.check()
+    follower.check()
+
+    leader.stop()
+    source.publish(changed_dataset())
+    assert follower.check() is True
+    assert follower.stats()['leader']
+    assert len(source.requests) == 2
+    follower.stop()
+
+
+def test_snapshot_holding_the_version_is_not_rewritten(source, tmp_path):
+    source.publish(changed_dataset())
+    path = tmp_path / 'ciq_snapshot.bin'
+    ciq_store.write_snapshot(changed_dataset(), str(path), source='sync:1')
+    inode = path.stat().st_ino
+    sync = DatasetSync(source.url, snapshot_path=str(path))
+
+    assert sync.check() is True
+    assert path.stat().st_ino == inode
+    sync.stop()
+
+
+def start_bot(source, tmp_path):
+    """Import the bot in a fresh process, as a worker does, and wait for its first sync."""
+    env = dict(
+        os.environ,
+        LINE_CHANNEL_SECRET='test-secret',
+        LINE_CHANNEL_ACCESS_TOKEN='test-token',
+        CIQ_SYNC_URL=source.url,
+        CIQ_SYNC_INTERVAL_S='3600',
+        CIQ_SNAPSHOT=str(tmp_path / 'ciq_snapshot.bin'),
+        CIQ_HISTORY_PATH=str(tmp_path / 'history.jsonl'),
+        CIQ_CARD_DIR=str(tmp_path / 'cards'),
+    )
+    script = (
+        "import time, line_ciq_bot as bot\n"
+        "for _ in range(200):\n"
+        "    if bot.syncer.stats()['checks']: break\n"
+        "    time.sleep(0.05)\n"
+        "bot.syncer.stop()\n"
+        "bot.syncer._thread.join(10)\n"
+        "print(bot.history.head, bot.current()['KUL']['GD'])\n"
+    )
+    result = subprocess.run(
+        [sys.executable, '-c', script], env=env, cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True, text=True, timeout=60, check=True,
+    )
+    return result.stdout.split(None, 1)
+
+
+def test_restarts_do_not_record_bundled_data(source, tmp_path):
+    source.publish(changed_dataset())
+    snapshot = tmp_path / 'ciq_snapshot.bin'
+    history = tmp_path / 'history.jsonl'
+
+    # A fresh deploy starts from ciq_data.py; only the synced data is recorded
+    assert start_bot(source, tmp_path) == ['1', '3 copies prepared by GS\n']
+
+    # A restart with ciq_data.py newer than the synced snapshot keeps the snapshot
+    os.utime(snapshot, (0, 0))
+    assert start_bot(source, tmp_path) == ['1', '3 copies prepared by GS\n']
+
+    # A restart without the snapshot (ephemeral disk) records nothing new either
+    snapshot.unlink()
+    assert start_bot(source, tmp_path) == ['1', '3 copies prepared by GS\n']
+    assert len(history.read_text().splitlines()) == 1
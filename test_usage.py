@@ -0,0 +1,84 @@
+"""Tests for the decayed per-chat and per-user station usage model."""
+from usage import UsageModel
+
+HOUR = 3600.0
+
+
+def model(**kwargs):
+    settings = dict(half_life_s=HOUR, max_keys=100, max_codes=8, idle_s=100 * HOUR)
+    settings.update(kwargs)
+    return UsageModel(**settings)
+
+
+def test_suggests_most_asked_first():
+    usage = model()
+    for code, count in [('KUL', 3), ('SIN', 1), ('HKG', 2)]:
+        for _ in range(count):
+            usage.record(['U1'], code, now=0)
+
+    assert usage.suggest(['U1'], now=0) == ['KUL', 'HKG', 'SIN']
+    assert usage.suggest(['U1'], limit=2, now=0) == ['KUL', 'HKG']
+    assert usage.suggest(['nobody'], now=0) == []
+
+
+def test_exclude_drops_the_station_just_asked_for():
+    usage = model()
+    usage.record(['U1'], 'KUL', now=0)
+    usage.record(['U1'], 'SIN', now=0)
+
+    assert usage.suggest(['U1'], exclude=('KUL',), now=0) == ['SIN']
+
+
+def test_counts_decay_with_the_half_life():
+    usage = model()
+    usage.record(['U1'], 'KUL', now=0)
+    usage.record(['U1'], 'KUL', now=0)
+    usage.record(['U1'], 'KUL', now=0)
+    # Three queries two half-lives ago weigh 0.75, less than one query now
+    usage.record(['U1'], 'SIN', now=2 * HOUR)
+
+    assert usage.suggest(['U1'], now=2 * HOUR) == ['SIN', 'KUL']
+    scores = usage._entries['U1'][1]
+    assert abs(scores['KUL'] - 0.75) < 1e-9
+
+
+def test_suggest_combines_keys():
+    usage = model()
+    usage.record([('user', 'U1')], 'KUL', now=0)
+    usage.record([('chat', 'G1')], 'SIN', now=0)
+    usage.record([('chat', 'G1')], 'SIN', now=0)
+
+    assert usage.suggest([('user', 'U1'), ('chat', 'G1')], now=0) == ['SIN', 'KUL']
+
+
+def test_codes_per_key_are_capped():
+    usage = model(max_codes=2)
+    usage.record(['U1'], 'KUL', now=0)
+    usage.record(['U1'], 'KUL', now=0)
+    usage.record(['U1'], 'SIN', now=1)
+    usage.record(['U1'], 'HKG', now=2)
+
+    # The weakest code makes room for the new one
+    assert sorted(usage.suggest(['U1'], now=2)) == ['HKG', 'KUL']
+
+
+def test_least_recently_used_keys_are_evicted():
+    usage = model(max_keys=2)
+    usage.record(['U1'], 'KUL', now=0)
+    usage.record(['U2'], 'KUL', now=1)
+    usage.record(['U1'], 'SIN', now=2)
+    usage.record(['U3'], 'KUL', now=3)
+
+    assert len(usage) == 2
+    assert usage.suggest(['U2'], now=3) == []
+    assert usage.suggest(['U1'], now=3) == ['SIN', 'KUL']
+
+
+def test_idle_keys_are_dropped():
+    usage = model(idle_s=10 * HOUR)
+    usage.record(['U1'], 'KUL', now=0)
+    usage.record(['U2'], 'KUL', now=5 * HOUR)
+    usage.record(['U3'], 'KUL', now=12 * HOUR)
+
+    assert len(usage) == 2
+    assert usage.suggest(['U1'], now=12 * HOUR) == []
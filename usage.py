@@ -0,0 +1,87 @@
+"""In-memory model of which stations each group and user asks about.
+
+Every chat (group, room or 1:1) and every user keeps exponentially decayed
+query counts for at most ``CIQ_USAGE_MAX_CODES`` stations. Scores are only
+decayed when their entry is touched, so recording a query costs a handful
+of float operations. At most ``CIQ_USAGE_MAX_KEYS`` entries are kept; the
+least recently used go first, and entries idle for ``CIQ_USAGE_IDLE_H``
+hours are dropped.
+"""
+from collections import OrderedDict
+import os
+import threading
+import time
+
+USAGE_HALF_LIFE_H = float(os.getenv('CIQ_USAGE_HALF_LIFE_H', '72'))
+USAGE_MAX_KEYS = int(os.getenv('CIQ_USAGE_MAX_KEYS', '5000'))
+USAGE_MAX_CODES = int(os.getenv('CIQ_USAGE_MAX_CODES', '8'))
+USAGE_IDLE_H = float(os.getenv('CIQ_USAGE_IDLE_H', '336'))
+
+
+class UsageModel:
+    """Decayed per-key station query counts, bounded in keys and codes."""
+
+    def __init__(self, half_life_s=USAGE_HALF_LIFE_H * 3600, max_keys=USAGE_MAX_KEYS,
+                 max_codes=USAGE_MAX_CODES, idle_s=USAGE_IDLE_H * 3600):
+        self.half_life_s = half_life_s
+        self.max_keys = max_keys
+        self.max_codes = max_codes
+        self.idle_s = idle_s
+        self._entries = OrderedDict()  # key -> [last update time, {code: score at that time}]
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _decay(self, entry, now):
+        elapsed = now - entry[0]
+        if elapsed > 0:
+            factor = 0.5 ** (elapsed / self.half_life_s)
+            scores = entry[1]
+            for code in scores:
+                scores[code] *= factor
+            entry[0] = now
+
+    def record(self, keys, code, now=None):
+        """Count one query for ``code`` under each of ``keys``."""
+        now = time.time() if now is None else now
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is None:
+                    entry = self._entries[key] = [now, {}]
+                else:
+                    self._entries.move_to_end(key)
+                    self._decay(entry, now)
+                scores = entry[1]
+                scores[code] = scores.get(code, 0.0) + 1.0
+                if len(scores) > self.max_codes:
+                    del scores[min(scores, key=scores.get)]
+            self._evict(now)
+
+    def _evict(self, now):
+        entries = self._entries
+        while len(entries) > self.max_keys:
+            entries.popitem(last=False)
+        # Least recently used first, so stop at the first entry still active
+        while entries:
+            key, entry = next(iter(entries.items()))
+            if now - entry[0] < self.idle_s:
+                break
+            del entries[key]
+
+    def suggest(self, keys, exclude=(), limit=4, now=None):
+        """Return up to ``limit`` codes ``keys`` are most likely to ask for next."""
+        now = time.time() if now is None else now
+        totals = {}
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is None:
+                    continue
+                factor = 0.5 ** (max(now - entry[0], 0) / self.half_life_s)
+                for code, score in entry[1].items():
+                    totals[code] = totals.get(code, 0.0) + score * factor
+        for code in exclude:
+            totals.pop(code, None)
+        return sorted(totals, key=totals.get, reverse=True)[:limit]